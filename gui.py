@@ -1,20 +1,26 @@
 import sys
 import multiprocessing
+import multiprocessing.connection
+from multiprocessing.connection import Connection
 import sqlite3
 import json
-from queue import Empty
-from enum import IntEnum, auto
-from typing import Dict, Any, Optional, Tuple
-import uuid
-import datetime
+import copy
+from enum import IntEnum, auto, unique
+from typing import Deque, Dict, Any, List, Optional, Tuple
+import time
+import threading
+import functools
 import pyaudio
-import re
 import os
+import shutil
 import setup as setup_module
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextlib import contextmanager
 
-from PySide6.QtCore import QThread, Signal, QObject, Qt, QSize, Slot
-from PySide6.QtGui import QIcon, QAction
+from PySide6.QtCore import QThread, QThreadPool, Signal, QObject, Qt, QSize, Slot, QTimer
+from PySide6.QtGui import QIcon, QAction, QTextCursor
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                                QHBoxLayout, QPushButton, QTextBrowser, QLabel, QGroupBox,
                                QMenuBar, QSplitter, QSystemTrayIcon, QMenu, QStyle, QDialog, QComboBox, QMessageBox, QLineEdit, QSpinBox, QCheckBox, QFileDialog, QFormLayout)
@@ -23,6 +29,8 @@ from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
 from workers.record_worker import record_worker
 from workers.transcribe_worker import transcribe_worker
 from workers.metagen_worker import metagen_worker
+from workers.command_channel import CommandChannel, create_command_channel, create_result_channel, recv_into
+from workers.events import Event
 
 # --- モダンなダークテーマのスタイルシート ---
 MODERN_STYLESHEET = """
@@ -100,140 +108,310 @@ QSplitter::handle:hover {
 """
 
 # --- ワーカー状態管理用 Enum と定数 ---
+@unique
 class WorkerStatus(IntEnum):
     IDLE = 0
     RUNNING = 1
     PAUSED = 2
     ERROR = 3
 
-WORKER_STATUS_TEXT = {
-    WorkerStatus.IDLE: "🟢 待機中",
-    WorkerStatus.RUNNING: "🟡 処理中",
-    WorkerStatus.PAUSED: "⏸️ 停止中",
-    WorkerStatus.ERROR: "🚨 エラー",
-}
-WORKER_STATUS_COLOR = {
-    WorkerStatus.IDLE: "green",
-    WorkerStatus.RUNNING: "orange",
-    WorkerStatus.PAUSED: "gray",
-    WorkerStatus.ERROR: "red",
-}
+# WorkerStatusの値(0始まりの連番)で直接インデックスする
+_STATUS_TEXT = ("🟢 待機中", "🟡 処理中", "⏸️ 停止中", "🚨 エラー")
+_STATUS_COLOR = ("green", "orange", "gray", "red")
+_STATUS_HTML = tuple(f'<b style="color:{color};">{text}</b>' for text, color in zip(_STATUS_TEXT, _STATUS_COLOR))
+# イベント -> 遷移先のワーカー状態 (Eventの値で直接インデックスする。状態が変わらないイベントはNone)
+STATUS_TRANSITIONS = tuple({
+    Event.RECORD_STARTED: WorkerStatus.RUNNING,
+    Event.TRANSCRIBE_STARTED: WorkerStatus.RUNNING,
+    Event.META_STARTED: WorkerStatus.RUNNING,
+    Event.RECORD_PAUSED: WorkerStatus.PAUSED,
+    Event.RECORD_RESUMED: WorkerStatus.RUNNING,
+    Event.RECORD_DONE: WorkerStatus.IDLE,
+    Event.TRANSCRIBE_DONE: WorkerStatus.IDLE,
+    Event.META_DONE: WorkerStatus.IDLE,
+    Event.RECORD_IDLE: WorkerStatus.IDLE,
+    Event.TRANSCRIBE_IDLE: WorkerStatus.IDLE,
+    Event.META_IDLE: WorkerStatus.IDLE,
+    Event.ERROR: WorkerStatus.ERROR,
+}.get(event) for event in Event)
 
 def validate_config(config: Dict[str, Any]):
     """設定ファイルに必要なキーが存在するかを検証する。"""
     if not all(k in config for k in ["db_path", "base_dir", "record_worker", "transcribe_worker", "metagen_worker"]):
         raise KeyError("トップレベルの必須キーが不足しています。")
 
+_log_time_cache = (0, "")
+def format_log_time(timestamp: float) -> str:
+    """ログ用のタイムスタンプ文字列を返す。同じ秒の間は前回の整形結果を再利用する。"""
+    global _log_time_cache
+    sec = int(timestamp)
+    if sec != _log_time_cache[0]:
+        _log_time_cache = (sec, time.strftime("[%Y-%m-%d %H:%M:%S]", time.localtime(sec)))
+    return _log_time_cache[1]
+
+# リスナーが1回の起床でまとめて処理するイベントの最大数
+LISTENER_BATCH_SIZE = 32
+# 未処理ジョブをDBから引くとき、1回のSELECTでまとめて先読みする件数
+JOB_PREFETCH_SIZE = 8
+
 class Status(IntEnum):
     """各セッションの処理状態を示すEnum。"""
     ERROR = -1; PENDING = 0; TRANSCRIBE_DONE = 1; META_DONE = 2
+# クエリのパラメータに毎回.valueを引かずに済むよう、よく使う値は素のintで持っておく
+_STATUS_PENDING, _STATUS_TRANSCRIBE_DONE = int(Status.PENDING), int(Status.TRANSCRIBE_DONE)
+
+# バックグラウンドでWALをチェックポイントする間隔(秒)
+WAL_CHECKPOINT_INTERVAL = 30
+# 保留中のステータス更新がこの件数に達したら、バッチの途中でも書き込む
+STATUS_FLUSH_THRESHOLD = 64
+
+# --- 頻繁に実行するSQL (同一オブジェクトを使い回してステートメントキャッシュに確実にヒットさせる) ---
+# 同じステータスへ遷移するセッションをまとめて1文で更新する (プレースホルダ数ごとに文字列を使い回す)
+_SQL_UPDATE_STATUS_IN = "UPDATE recordings SET status = ? WHERE id IN ({})"
+_update_status_sql_cache: Dict[int, str] = {}
+def _update_status_sql(count: int) -> str:
+    sql = _update_status_sql_cache.get(count)
+    if sql is None: sql = _update_status_sql_cache[count] = _SQL_UPDATE_STATUS_IN.format(", ".join("?" * count))
+    return sql
+_SQL_FIND_PENDING_TRANSCRIBE = "SELECT id, file_path FROM recordings WHERE status = ? ORDER BY start_time ASC LIMIT ?"
+_SQL_FIND_PENDING_META = "SELECT r.id, t.segments_json FROM recordings r JOIN transcribes t ON r.id = t.id WHERE r.status = ? ORDER BY r.start_time ASC LIMIT ?"
+_SQL_INSERT_RECORDING = "INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?, ?)"
+_SQL_INSERT_TRANSCRIBE = "INSERT OR REPLACE INTO transcribes VALUES (?, ?)"
+# markers/tagsのidはINTEGER PRIMARY KEY(rowid)なのでSQLiteに採番させる
+_SQL_INSERT_MARKER = "INSERT INTO markers (session_id, timestamp, label) VALUES (?, ?, ?)"
+_SQL_INSERT_TAG = "INSERT INTO tags (session_id, tag) VALUES (?, ?)"
+# 保留バッファと挿入文の対応。外部キーを満たすよう、この順で書き込む
+_PENDING_INSERTS = (('recordings', _SQL_INSERT_RECORDING), ('transcribes', _SQL_INSERT_TRANSCRIBE), ('markers', _SQL_INSERT_MARKER), ('tags', _SQL_INSERT_TAG))
+# (status, start_time, id)の索引だけで未処理ジョブ検索の絞り込み・並べ替え・id取得まで済む(カバリングインデックス)
+_SQL_FIND_JOB_INDEX = "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_recordings_status_starttime_id'"
+# 以前はTEXTのUUIDをidにしていたテーブルと、移行時にコピーする列
+_LEGACY_ID_TABLES = {"markers": "session_id, timestamp, label", "tags": "session_id, tag"}
+_SQL_TABLE_EXISTS = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+# スキーマ。移行と同じトランザクションで作れるよう、executescriptではなく1文ずつ実行する
+_SCHEMA_TABLES = (
+    "CREATE TABLE IF NOT EXISTS recordings (id TEXT PRIMARY KEY, start_time TEXT, length REAL, file_path TEXT, status INTEGER)",
+    "CREATE TABLE IF NOT EXISTS transcribes (id TEXT PRIMARY KEY, segments_json TEXT, FOREIGN KEY (id) REFERENCES recordings (id))",
+    "CREATE TABLE IF NOT EXISTS markers (id INTEGER PRIMARY KEY, session_id TEXT, timestamp REAL, label TEXT, FOREIGN KEY (session_id) REFERENCES recordings (id))",
+    "CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY, session_id TEXT, tag TEXT, FOREIGN KEY (session_id) REFERENCES recordings (id))")
+_SCHEMA_INDEXES = (
+    "DROP INDEX IF EXISTS idx_recordings_status_starttime",
+    "CREATE INDEX IF NOT EXISTS idx_recordings_status_starttime_id ON recordings(status, start_time, id)",
+    "CREATE INDEX IF NOT EXISTS idx_markers_session ON markers(session_id)",
+    "CREATE INDEX IF NOT EXISTS idx_tags_session ON tags(session_id)")
+
+class DBLockedError(Exception):
+    """DBファイルがロックされている、またはアクセスできない。"""
+
+class DBCorruptError(Exception):
+    """DBファイルを開けない (破損など)。"""
 
 class DatabaseManager:
-    """DB接続と操作をカプセル化するクラス"""
+    """DB接続と操作をカプセル化するクラス
+    書き込みはリスナースレッドが所有する self.conn で行い、
+    未処理ジョブ検索やUIなど他スレッドからの参照系クエリは get_reader() の読み取り専用接続を使う。"""
     def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local(); self._readers = []; self._readers_lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+        self._checkpoint_stop = threading.Event(); self._checkpointer: Optional[threading.Thread] = None
+        # イベントごとにコミットせず、flush()でまとめて書き込むための保留バッファ
+        self._pending: Dict[str, List[tuple]] = {'recordings': [], 'transcribes': [], 'markers': [], 'tags': []}
+        # session_id -> 最後に遷移したステータス。途中の遷移は最終値で上書きされる
+        self._pending_status: Dict[str, int] = {}
         try:
-            self.conn: sqlite3.Connection = sqlite3.connect(db_path, check_same_thread=False)
+            self.conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
             self._init_db()
+            self._checkpointer = threading.Thread(target=self._checkpoint_loop, name="WALCheckpointer", daemon=True)
+            self._checkpointer.start()
         except (PermissionError, OSError) as e:
-            from PySide6.QtWidgets import QApplication, QMessageBox
-            import sys
-            app = QApplication.instance() or QApplication(sys.argv)
-            QMessageBox.critical(None, "DBファイルロック", f"DBファイルがロックされているか、アクセスできません:\n{e}\n他のプロセスで開いていないか確認してください。")
-            sys.exit(1)
+            self.close(); raise DBLockedError(str(e)) from e
         except Exception as e:
-            from PySide6.QtWidgets import QApplication, QMessageBox
-            import sys, shutil, os
-            app = QApplication.instance() or QApplication(sys.argv)
-            msg = QMessageBox()
-            msg.setWindowTitle("DBエラー")
-            msg.setText(f"DBファイルのオープンに失敗しました: {e}\n修復または初期化しますか？")
-            repair_btn = msg.addButton("修復(バックアップ後新規作成)", QMessageBox.ButtonRole.AcceptRole)
-            init_btn = msg.addButton("初期化(新規作成)", QMessageBox.ButtonRole.DestructiveRole)
-            quit_btn = msg.addButton("終了", QMessageBox.ButtonRole.RejectRole)
-            msg.setDefaultButton(repair_btn)
-            msg.exec()
-            if msg.clickedButton() == repair_btn:
-                if os.path.exists(db_path):
-                    shutil.copy2(db_path, db_path+".bak")
-                    os.remove(db_path)
-                self.conn = sqlite3.connect(db_path, check_same_thread=False)
-                self._init_db()
-            elif msg.clickedButton() == init_btn:
-                if os.path.exists(db_path):
-                    os.remove(db_path)
-                self.conn = sqlite3.connect(db_path, check_same_thread=False)
-                self._init_db()
-            else:
-                sys.exit(1)
+            # 修復時にファイルを削除できるよう、開いた接続は閉じておく
+            self.close(); raise DBCorruptError(str(e)) from e
     def _init_db(self):
-        self.conn.execute("PRAGMA journal_mode=WAL;"); cursor = self.conn.cursor()
-        cursor.execute("CREATE TABLE IF NOT EXISTS recordings (id TEXT PRIMARY KEY, start_time TEXT, length REAL, file_path TEXT, status INTEGER);")
-        cursor.execute("CREATE TABLE IF NOT EXISTS transcribes (id TEXT PRIMARY KEY, segments_json TEXT, FOREIGN KEY (id) REFERENCES recordings (id));")
-        cursor.execute("CREATE TABLE IF NOT EXISTS markers (id TEXT PRIMARY KEY, session_id TEXT, timestamp REAL, label TEXT, FOREIGN KEY (session_id) REFERENCES recordings (id));")
-        cursor.execute("CREATE TABLE IF NOT EXISTS tags (id TEXT PRIMARY KEY, session_id TEXT, tag TEXT, FOREIGN KEY (session_id) REFERENCES recordings (id));")
-        self.conn.commit()
+        # WAL + synchronous=NORMAL: クラッシュ時に直近数件のイベントが失われる可能性はあるが、DBの整合性は保たれる
+        self.conn.executescript("PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA temp_store=MEMORY; PRAGMA cache_size=-65536; PRAGMA mmap_size=268435456; PRAGMA wal_autocheckpoint=1000; PRAGMA busy_timeout=5000; PRAGMA foreign_keys=ON;")
+        # 未処理ジョブ検索用の索引を作り直す場合は、統計を取り直してプランナーに使わせる
+        need_analyze = self.conn.execute(_SQL_FIND_JOB_INDEX).fetchone() is None
+        # idがTEXTの旧テーブルは退避しておき、新しいスキーマで作り直してから中身を移す。
+        # 退避・作成・コピー・削除は1つのトランザクションで行い、途中で終了しても移行前の状態に戻るようにする
+        with self.write_txn():
+            legacy = [t for t in _LEGACY_ID_TABLES if any(c[1] == 'id' and c[2].upper() == 'TEXT' for c in self.conn.execute(f"PRAGMA table_info({t})"))]
+            for t in legacy: self.conn.execute(f"DROP INDEX IF EXISTS idx_{t}_session"); self.conn.execute(f"ALTER TABLE {t} RENAME TO {t}_legacy")
+            for sql in _SCHEMA_TABLES: self.conn.execute(sql)
+            # 以前の版で移行が途中で止まり、退避先だけが残っている場合もここでコピーを済ませる
+            for t, cols in _LEGACY_ID_TABLES.items():
+                if self.conn.execute(_SQL_TABLE_EXISTS, (f"{t}_legacy",)).fetchone() is None: continue
+                self.conn.execute(f"INSERT INTO {t} ({cols}) SELECT {cols} FROM {t}_legacy ORDER BY rowid"); self.conn.execute(f"DROP TABLE {t}_legacy")
+            # 退避先のテーブルに残っていた同名の索引が消えてから作る
+            for sql in _SCHEMA_INDEXES: self.conn.execute(sql)
+        if need_analyze: self.conn.execute("ANALYZE")
+    def get_reader(self) -> sqlite3.Connection:
+        """呼び出しスレッド専用の読み取り専用接続を返す。WAL下では書き込み中でもブロックされずに読める。"""
+        reader = getattr(self._local, 'reader', None)
+        if reader is None:
+            reader = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+            reader.execute("PRAGMA query_only=1;")
+            self._local.reader = reader
+            with self._readers_lock: self._readers.append(reader)
+        return reader
+    def _checkpoint_loop(self):
+        """WALの書き戻しを定期的にPASSIVEで行い、リスナーのコミット中に自動チェックポイントで詰まらないようにする。"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            while not self._checkpoint_stop.wait(WAL_CHECKPOINT_INTERVAL):
+                try: conn.execute("PRAGMA wal_checkpoint(PASSIVE);")
+                except sqlite3.Error: pass
+        finally: conn.close()
     def close(self):
-        if self.conn: self.conn.close()
+        self._checkpoint_stop.set()
+        if self._checkpointer: self._checkpointer.join()
+        with self._readers_lock:
+            for reader in self._readers: reader.close()
+            self._readers.clear()
+        if self.conn:
+            try: self.flush()
+            finally: self.conn.close()
+    @contextmanager
+    def write_txn(self):
+        """書き込みトランザクション。BEGIN IMMEDIATEで最初に書き込みロックを取り、途中でのロック昇格待ちを避ける。"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.rollback(); raise
+        self.conn.commit()
     def _update_status(self, session_id: str, status: Status):
-        with self.conn: self.conn.execute("UPDATE recordings SET status = ? WHERE id = ?", (status.value, session_id))
-    def find_pending_transcribe_job(self) -> Optional[Tuple[str, str]]:
-        cursor = self.conn.cursor(); cursor.execute("SELECT id, file_path FROM recordings WHERE status = ? ORDER BY start_time ASC LIMIT 1", (Status.PENDING.value,)); return cursor.fetchone()
-    def find_pending_meta_job(self) -> Optional[Tuple[str, str]]:
-        cursor = self.conn.cursor(); cursor.execute("SELECT r.id, t.segments_json FROM recordings r JOIN transcribes t ON r.id = t.id WHERE r.status = ? ORDER BY r.start_time ASC LIMIT 1", (Status.TRANSCRIBE_DONE.value,)); return cursor.fetchone()
+        self._pending_status[session_id] = status.value
+        if len(self._pending_status) >= STATUS_FLUSH_THRESHOLD: self.flush()
+    def flush(self):
+        """溜めておいた書き込みを1トランザクションでまとめてコミットする。リスナースレッドから呼ぶ。"""
+        pending = self._pending; pending_status = self._pending_status
+        if not pending_status and not any(pending.values()): return
+        # ステータスごとにsession_idをまとめ、UPDATE ... WHERE id IN (...) 1文ずつにする
+        status_groups: Dict[int, List[str]] = {}
+        for sid, status in pending_status.items(): status_groups.setdefault(status, []).append(sid)
+        try:
+            with self.write_txn():
+                for key, sql in _PENDING_INSERTS: self.conn.executemany(sql, pending[key])
+                # ステータス更新は行の挿入後に適用する
+                for status, sids in status_groups.items(): self.conn.execute(_update_status_sql(len(sids)), (status, *sids))
+        except sqlite3.Error as e:
+            # ロールバックされたので、1行ずつ書き直して失敗した行だけを捨てる
+            print(f"[WARNING] Batched DB write failed, retrying row by row: {e}")
+            self._flush_one_by_one(); return
+        # バッファはコミットに成功してから空にする
+        for rows in pending.values(): rows.clear()
+        pending_status.clear()
+    def _flush_one_by_one(self):
+        """
+        保留中の行とステータス更新を1件ずつ別トランザクションで書き込む。制約違反など、その行自体が原因の失敗はその行だけを捨てる。
+        ロック待ちのタイムアウトは他の行も同じく失敗するので、残りはすべて次のflush()まで持ち越す。
+        """
+        def write(sql: str, params: tuple, sid: str) -> Optional[bool]:
+            """書き込めればTrue、行を捨てるならFalse、持ち越すならNoneを返す。"""
+            try:
+                with self.write_txn(): self.conn.execute(sql, params)
+                return True
+            except sqlite3.Error as e:
+                if isinstance(e, sqlite3.OperationalError) and ("locked" in str(e) or "busy" in str(e)): return None
+                print(f"[ERROR] Dropped DB write for session {sid}: {e}"); return False
+        # 各行の先頭はsession_id
+        for key, sql in _PENDING_INSERTS:
+            rows = self._pending[key]
+            while rows:
+                if write(sql, rows[0], rows[0][0]) is None: return
+                rows.pop(0)
+        pending_status = self._pending_status
+        while pending_status:
+            sid, status = next(iter(pending_status.items()))
+            if write(_update_status_sql(1), (status, sid), sid) is None: return
+            del pending_status[sid]
+    def find_pending_transcribe_jobs(self, limit: int) -> List[Tuple[str, str]]:
+        self.flush()
+        return self.get_reader().execute(_SQL_FIND_PENDING_TRANSCRIBE, (_STATUS_PENDING, limit)).fetchall()
+    def find_pending_meta_jobs(self, limit: int) -> List[Tuple[str, str]]:
+        self.flush()
+        return self.get_reader().execute(_SQL_FIND_PENDING_META, (_STATUS_TRANSCRIBE_DONE, limit)).fetchall()
     def handle_record_done(self, message: Dict[str, Any]):
         p = message.get('payload', {}); sid = p.get('session_id')
-        with self.conn: self.conn.execute("INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?, ?)", (sid, p['start_time'], p['length'], p['file_path'], Status.PENDING.value))
+        self._pending['recordings'].append((sid, p['start_time'], p['length'], p['file_path'], _STATUS_PENDING))
     def handle_transcribe_done(self, message: Dict[str, Any]):
         p = message.get('payload', {}); sid = p.get('session_id', "")
-        with self.conn: self.conn.execute("INSERT OR REPLACE INTO transcribes VALUES (?, ?)", (sid, json.dumps(p['segments_json']))); self._update_status(sid, Status.TRANSCRIBE_DONE)
+        segments_json = p['segments_json']  # ワーカーからはJSON文字列で届く
+        # シリアライズは書き込みトランザクションの外で済ませる
+        if not isinstance(segments_json, str): segments_json = json.dumps(segments_json, ensure_ascii=False, separators=(',', ':'))
+        self._pending['transcribes'].append((sid, segments_json)); self._update_status(sid, Status.TRANSCRIBE_DONE)
     def handle_meta_done(self, message: Dict[str, Any]):
         p = message.get('payload', {}); sid = p.get('session_id', "")
         if not sid: return
-        with self.conn:
-            for marker in p.get('markers', []): self.conn.execute("INSERT INTO markers VALUES (?, ?, ?, ?)", (str(uuid.uuid4()), sid, marker.get('time'), marker.get('content')))
-            for tag in p.get('tags', []): self.conn.execute("INSERT INTO tags VALUES (?, ?, ?)", (str(uuid.uuid4()), sid, tag))
-            self._update_status(sid, Status.META_DONE)
+        markers = p.get('markers', []); tags = p.get('tags', [])
+        # markersはワーカーから (time, content) のタプルで届く
+        self._pending['markers'].extend((sid, marker_time, content) for marker_time, content in markers)
+        self._pending['tags'].extend((sid, t) for t in tags)
+        self._update_status(sid, Status.META_DONE)
     def handle_error(self, message: Dict[str, Any]):
         p = message.get('payload', {}); sid = p.get('session_id')
-        if sid: self._update_status(sid, Status.ERROR)
+        # retryが付いたエラー(通信失敗など)はERRORにせず、未処理のまま残して後で再試行させる
+        if sid and not p.get('retry'): self._update_status(sid, Status.ERROR)
 
 class EventListener:
     """ワーカーからのイベントを処理し、GUIに通知するクラス"""
-    def __init__(self, db_manager: DatabaseManager, result_queue: multiprocessing.Queue, command_queues: Dict[str, multiprocessing.Queue]):
-        self.db_manager = db_manager; self.result_queue = result_queue; self.command_queues = command_queues
+    def __init__(self, db_manager: DatabaseManager, result_conns: List[Connection], command_queues: Dict[str, CommandChannel]):
+        # result_conns: ワーカーごと(+メインプロセス自身)の結果通知用Pipeの受信側。届いたものから順に読む
+        self.db_manager = db_manager; self.result_conns = result_conns; self.command_queues = command_queues
         self.is_running = True; self.signals: Optional[BackendSignals] = None
         self.ai_processing_paused = False
-        self.event_handlers = {
-            'record_started': self.handle_record_started,
-            'record_done': self.db_manager.handle_record_done,
-            'record_paused': self.handle_record_paused,
-            'record_resumed': self.handle_record_resumed,
-            'record_idle': self.handle_record_idle,
-            'transcribe_started': self.handle_transcribe_started,
-            'transcribe_done': self.db_manager.handle_transcribe_done,
-            'transcribe_idle': self.handle_transcribe_idle,
-            'meta_started': self.handle_meta_started,
-            'meta_done': self.db_manager.handle_meta_done,
-            'meta_idle': self.handle_meta_idle,
-            'error': self.handle_error,
-            'request_transcribe_job': self.handle_transcribe_job_request,
-            'request_metagen_job': self.handle_meta_job_request,
-            'toggle_ai_pause': self.toggle_ai_pause,
+        self._batching = False; self._batch_logs = []; self._batch_status = {}
+        # このプロセス内で完了したばかりのジョブ。空のときだけDBを検索する
+        self.transcribe_ready: Deque[Tuple[str, str]] = deque(); self.meta_ready: Deque[Tuple[str, str]] = deque()
+        # ジョブが無かったためにstandbyを返さず、指令待ちのまま保留しているワーカー名
+        # (メタデータ生成ワーカーは複数のジョブを並行して処理するので、保留中の要求を1件ずつ積む)
+        self._waiting_transcribe: Optional[str] = None; self._waiting_meta: Deque[str] = deque()
+        # 割り当て中のsession_id -> ワーカー名 (先読みしたジョブを二重に割り当てないため)
+        self._in_flight: Dict[str, str] = {}
+        handlers = {
+            Event.RECORD_STARTED: self.handle_record_started,
+            Event.RECORD_DONE: self.handle_record_done,
+            Event.RECORD_PAUSED: self.handle_record_paused,
+            Event.RECORD_RESUMED: self.handle_record_resumed,
+            Event.RECORD_IDLE: self.handle_record_idle,
+            Event.TRANSCRIBE_STARTED: self.handle_transcribe_started,
+            Event.TRANSCRIBE_DONE: self.handle_transcribe_done,
+            Event.TRANSCRIBE_IDLE: self.handle_transcribe_idle,
+            Event.META_STARTED: self.handle_meta_started,
+            Event.META_DONE: self.handle_meta_done,
+            Event.META_IDLE: self.handle_meta_idle,
+            Event.ERROR: self.handle_error,
+            Event.REQUEST_TRANSCRIBE_JOB: self.handle_transcribe_job_request,
+            Event.REQUEST_METAGEN_JOB: self.handle_meta_job_request,
+            Event.TOGGLE_AI_PAUSE: self.toggle_ai_pause,
         }
+        # Eventの値で直接インデックスするハンドラ表
+        self.event_handlers = tuple(handlers.get(event) for event in Event)
     def log(self, message: str):
-        now = datetime.datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-        msg = f"{now} {message}"
+        # タイムスタンプの整形は表示側で行う
+        entry = (time.time(), message)
         if self.signals:
-            self.signals.log_message.emit(msg)
+            if self._batching: self._batch_logs.append(entry)
+            else: self.signals.log_message.emit([entry])
         else:
-            print(msg)
+            print(f"{format_log_time(entry[0])} {message}")
     def update_status(self, worker_name: str, status: WorkerStatus):
         if self.signals:
-            self.signals.worker_status_changed.emit(worker_name, status.value)
+            if self._batching: self._batch_status[worker_name] = status.value
+            else: self.signals.worker_status_changed.emit({worker_name: status.value})
         # ログ出力はここで行わない
+    def flush_batch(self):
+        """バッチ処理中に溜めたログと状態変化をまとめて1回ずつ通知する。"""
+        self._batching = False
+        if not self.signals: return
+        if self._batch_logs:
+            self.signals.log_message.emit(self._batch_logs); self._batch_logs = []
+        if self._batch_status:
+            self.signals.worker_status_changed.emit(self._batch_status); self._batch_status = {}
 
     def handle_record_started(self, message: Dict[str, Any]):
-        self.update_status("RecordWorker-1", WorkerStatus.RUNNING)
         self.log("録音ワーカーが開始されました。")
 
     def toggle_ai_pause(self, message: Dict[str, Any]):
@@ -242,87 +420,117 @@ class EventListener:
         self.log(f"AI処理を {state} にしました。")
         self.update_status("TranscribeWorker-1", WorkerStatus.PAUSED)
         self.update_status("MetaGenWorker-1", WorkerStatus.PAUSED)
+        self._dispatch_waiting()
+    def handle_record_done(self, message: Dict[str, Any]):
+        self.db_manager.handle_record_done(message)
+        p = message.get('payload', {}); self.transcribe_ready.append((p.get('session_id'), p['file_path']))
+        self._dispatch_waiting()
+    def handle_transcribe_done(self, message: Dict[str, Any]):
+        self.db_manager.handle_transcribe_done(message)
+        p = message.get('payload', {}); self._in_flight.pop(p.get('session_id'), None); self.meta_ready.append((p.get('session_id', ""), p['segments_json']))
+        self._dispatch_waiting()
+    def handle_meta_done(self, message: Dict[str, Any]):
+        self.db_manager.handle_meta_done(message)
+        self._in_flight.pop(message.get('payload', {}).get('session_id'), None)
+    def _next_job(self, ready: Deque[Tuple[str, str]], find_jobs) -> Optional[Tuple[str, str]]:
+        """手元のジョブが尽きていればDBからまとめて先読みし、先頭の1件を返す。"""
+        if not ready:
+            ready.extend(job for job in find_jobs(JOB_PREFETCH_SIZE) if job[0] not in self._in_flight)
+        return ready.popleft() if ready else None
+    def _dispatch_waiting(self):
+        """保留中のワーカーに、溜まっているジョブ(手元に無ければDBから先読み)をこちらから割り当てる。"""
+        if self.ai_processing_paused: return
+        if self._waiting_transcribe:
+            job = self._next_job(self.transcribe_ready, self.db_manager.find_pending_transcribe_jobs)
+            if job:
+                worker_name, self._waiting_transcribe = self._waiting_transcribe, None
+                self._assign_transcribe_job(worker_name, job)
+        while self._waiting_meta:
+            job = self._next_job(self.meta_ready, self.db_manager.find_pending_meta_jobs)
+            if not job: break
+            self._assign_meta_job(self._waiting_meta.popleft(), job)
+    def _assign_transcribe_job(self, worker_name: str, job: Tuple[str, str]):
+        session_id, file_path = job; self._in_flight[session_id] = worker_name
+        self.update_status("TranscribeWorker-1", WorkerStatus.RUNNING)
+        self.command_queues[worker_name].put({"task": "transcribe", "payload": {"session_id": session_id, "file_path": file_path}})
+    def _assign_meta_job(self, worker_name: str, job: Tuple[str, str]):
+        session_id, segments_json_str = job; self._in_flight[session_id] = worker_name
+        self.update_status("MetaGenWorker-1", WorkerStatus.RUNNING)
+        # DBのJSON文字列をそのまま渡し、デコードはワーカー側で一度だけ行う
+        self.command_queues[worker_name].put({"task": "generate_meta", "payload": {"session_id": session_id, "segments_json": segments_json_str}})
     def handle_transcribe_job_request(self, message: Dict[str, Any]):
-        worker_name = message.get("worker", ""); command_queue = self.command_queues.get(worker_name)
-        if not command_queue: return
-        if self.ai_processing_paused:
-            command_queue.put({"task": "standby"}); return
-        job = self.db_manager.find_pending_transcribe_job()
-        if job:
-            session_id, _ = job
-            self.update_status("TranscribeWorker-1", WorkerStatus.RUNNING)
-            command_queue.put({"task": "transcribe", "payload": {"session_id": session_id, "file_path": _}})
-        else:
-            command_queue.put({"task": "standby"})
+        worker_name = message.get("worker", "")
+        if worker_name not in self.command_queues: return
+        # 一時停止中やジョブが無いときは、standbyで待たせて再問い合わせさせる代わりに保留しておき、
+        # 再開時や次の録音完了時にこちらから割り当てる
+        job = None if self.ai_processing_paused else self._next_job(self.transcribe_ready, self.db_manager.find_pending_transcribe_jobs)
+        if job: self._assign_transcribe_job(worker_name, job)
+        else: self._waiting_transcribe = worker_name
 
     def handle_meta_job_request(self, message: Dict[str, Any]):
-        worker_name = message.get("worker", ""); command_queue = self.command_queues.get(worker_name)
-        if not command_queue: return
-        if self.ai_processing_paused:
-            command_queue.put({"task": "standby"}); return
-        job = self.db_manager.find_pending_meta_job()
-        if job:
-            session_id, segments_json_str = job
-            self.update_status("MetaGenWorker-1", WorkerStatus.RUNNING)
-            command_queue.put({"task": "generate_meta", "payload": {"session_id": session_id, "segments_json": json.loads(segments_json_str)}})
-        else:
-            command_queue.put({"task": "standby"})
+        worker_name = message.get("worker", "")
+        if worker_name not in self.command_queues: return
+        # 一時停止中やジョブが無いときは保留し、再開時や次の文字起こし完了時にこちらから割り当てる
+        job = None if self.ai_processing_paused else self._next_job(self.meta_ready, self.db_manager.find_pending_meta_jobs)
+        if job: self._assign_meta_job(worker_name, job)
+        else: self._waiting_meta.append(worker_name)
+    def _receive_batch(self) -> List[Dict[str, Any]]:
+        """どれかのPipeに届くまでブロックし、読めるPipeから届いている分をまとめて受け取る。"""
+        batch = []
+        for conn in multiprocessing.connection.wait(self.result_conns):
+            try:
+                recv_into(conn, batch)
+                while len(batch) < LISTENER_BATCH_SIZE and conn.poll(): recv_into(conn, batch)
+            except EOFError:
+                # ワーカーが終了して送信側が閉じられた
+                self.result_conns.remove(conn)
+        return batch
     def listen(self):
         self.log("🎧 Event listener started...")
         while self.is_running:
-            try:
-                message = self.result_queue.get(timeout=1)
-                event = message.get('event', "")
-                worker = message.get('worker', '')
-                # 新しいイベント名に対応
-                if event in ("record_started", "transcribe_started", "meta_started"):
-                    self.update_status(worker, WorkerStatus.RUNNING)
-                elif event in ("record_paused",):
-                    self.update_status(worker, WorkerStatus.PAUSED)
-                elif event in ("record_resumed",):
-                    self.update_status(worker, WorkerStatus.RUNNING)
-                elif event in ("record_done", "transcribe_done", "meta_done"):
-                    self.update_status(worker, WorkerStatus.IDLE)
-                elif event in ("record_idle", "transcribe_idle", "meta_idle"):
-                    self.update_status(worker, WorkerStatus.IDLE)
-                elif event == "error":
-                    self.update_status(worker, WorkerStatus.ERROR)
-                # 既存のイベントハンドラも呼ぶ
-                handler = self.event_handlers.get(event)
-                if handler:
-                    try: handler(message)
-                    except Exception as e: self.log(f"🚨 [ERROR] while handling '{event}': {e}")
-                else:
-                    self.log(f"🤔 [WARNING] Unknown event: '{event}'")
-            except Empty: continue
+            # ポーリングせずにブロッキングで待機し、届いた分はまとめて処理する
+            batch = self._receive_batch()
+            self._batching = True
+            for message in batch:
+                # request_stop()が投入する番兵で抜ける
+                if message.get('event') == Event.SHUTDOWN:
+                    self.is_running = False; break
+                self.dispatch(message)
+            # DB書き込みはバッチごとに1回のコミットに集約する
+            try: self.db_manager.flush()
+            except Exception as e: self.log(f"🚨 [ERROR] while flushing database writes: {e}")
+            self.flush_batch()
         self.log("Listener loop finished.")
 
+    def dispatch(self, message: Dict[str, Any]):
+        event = message.get('event')
+        handler = self.event_handlers[event] if isinstance(event, int) and 0 <= event < len(self.event_handlers) else None
+        if handler is None:
+            self.log(f"🤔 [WARNING] Unknown event: '{event}'"); return
+        status = STATUS_TRANSITIONS[event]
+        if status is not None: self.update_status(message.get('worker', ''), status)
+        try: handler(message)
+        except Exception as e: self.log(f"🚨 [ERROR] while handling '{Event(event).name}': {e}")
+
     def handle_record_paused(self, message: Dict[str, Any]):
-        self.update_status("RecordWorker-1", WorkerStatus.PAUSED)
         self.log("録音ワーカーが一時停止しました。")
 
     def handle_record_resumed(self, message: Dict[str, Any]):
-        self.update_status("RecordWorker-1", WorkerStatus.RUNNING)
         self.log("録音ワーカーが再開しました。")
 
     def handle_record_idle(self, message: Dict[str, Any]):
-        self.update_status("RecordWorker-1", WorkerStatus.IDLE)
         self.log("録音ワーカーが待機状態になりました。")
 
     def handle_transcribe_started(self, message: Dict[str, Any]):
-        self.update_status("TranscribeWorker-1", WorkerStatus.RUNNING)
         self.log("文字起こしワーカーが開始されました。")
 
     def handle_transcribe_idle(self, message: Dict[str, Any]):
-        self.update_status("TranscribeWorker-1", WorkerStatus.IDLE)
         self.log("文字起こしワーカーが待機状態になりました。")
 
     def handle_meta_started(self, message: Dict[str, Any]):
-        self.update_status("MetaGenWorker-1", WorkerStatus.RUNNING)
         self.log("メタデータ生成ワーカーが開始されました。")
 
     def handle_meta_idle(self, message: Dict[str, Any]):
-        self.update_status("MetaGenWorker-1", WorkerStatus.IDLE)
         self.log("メタデータ生成ワーカーが待機状態になりました。")
 
     def handle_error(self, message: Dict[str, Any]):
@@ -330,6 +538,11 @@ class EventListener:
         error_info = message.get('payload', {}).get('error_message', '詳細不明')
         self.log(f"🚨 {worker} でエラー発生: {error_info}")
         self.db_manager.handle_error(message)
+        sid = message.get('payload', {}).get('session_id')
+        if sid: self._in_flight.pop(sid, None)
+        else:
+            # session_idの無いエラーでも、そのワーカーに割り当て中の扱いは解く (次回の先読みで再試行される)
+            for session_id in [s for s, name in self._in_flight.items() if name == message.get('worker')]: del self._in_flight[session_id]
 
 class DeviceSelectDialog(QDialog):
     def __init__(self, pa, parent=None):
@@ -340,9 +553,7 @@ class DeviceSelectDialog(QDialog):
         self.vc_combo = QComboBox(self)
         self.mic_combo = QComboBox(self)
         self.device_list = []
-        for i in range(pa.get_device_count()):
-            info = pa.get_device_info_by_index(i)
-            name = fix_encoding(info['name'])
+        for i, _, name in enumerate_devices(pa):
             self.device_list.append((i, name))
             self.vc_combo.addItem(f"{i}: {name}", i)
             self.mic_combo.addItem(f"{i}: {name}", i)
@@ -361,7 +572,7 @@ class SettingsDialog(QDialog):
         super().__init__(parent)
         self.setWindowTitle("設定")
         self.setModal(True)
-        self.config = json.loads(json.dumps(config))  # ディープコピー
+        self.config = copy.deepcopy(config)
         self.pa = pa
         layout = QVBoxLayout(self)
         self.form_layouts = {}
@@ -369,21 +580,22 @@ class SettingsDialog(QDialog):
         record_group = QGroupBox("録音設定 (record_worker)")
         record_form = QFormLayout()
         # VCデバイス
+        devices = enumerate_devices(pa)
+        # 保存済みのindexはデバイスの抜き差しでずれている可能性があるので、名前で引き直してから選択する
+        rw = self.config['record_worker']
+        vc_index = device_index_resolver(pa, rw.get('vc_device_index'), rw.get('vc_device_name'))
+        mic_index = device_index_resolver(pa, rw.get('mic_device_index'), rw.get('mic_device_name'))
         self.vc_combo = QComboBox(self)
-        for i in range(pa.get_device_count()):
-            info = pa.get_device_info_by_index(i)
-            name = fix_encoding(info['name'])
+        for i, _, name in devices:
             self.vc_combo.addItem(f"{i}: {name}", i)
-            if i == self.config['record_worker'].get('vc_device_index', -1):
+            if i == vc_index:
                 self.vc_combo.setCurrentIndex(self.vc_combo.count()-1)
         record_form.addRow("VCデバイス", self.vc_combo)
         # マイクデバイス
         self.mic_combo = QComboBox(self)
-        for i in range(pa.get_device_count()):
-            info = pa.get_device_info_by_index(i)
-            name = fix_encoding(info['name'])
+        for i, _, name in devices:
             self.mic_combo.addItem(f"{i}: {name}", i)
-            if i == self.config['record_worker'].get('mic_device_index', -1):
+            if i == mic_index:
                 self.mic_combo.setCurrentIndex(self.mic_combo.count()-1)
         record_form.addRow("マイクデバイス", self.mic_combo)
         # その他パラメータ
@@ -410,9 +622,6 @@ class SettingsDialog(QDialog):
         transcribe_form.addRow("デバイス", self.device)
         self.compute_type = QLineEdit(self.config['transcribe_worker'].get('compute_type', ''))
         transcribe_form.addRow("compute_type", self.compute_type)
-        self.wait_seconds = QSpinBox(); self.wait_seconds.setRange(0, 600)
-        self.wait_seconds.setValue(self.config['transcribe_worker'].get('wait_seconds_if_no_job', 5))
-        transcribe_form.addRow("待機秒数", self.wait_seconds)
         transcribe_group.setLayout(transcribe_form)
         layout.addWidget(transcribe_group)
         # metagen_worker
@@ -422,9 +631,6 @@ class SettingsDialog(QDialog):
         meta_form.addRow("APIキー", self.api_key)
         self.model_name = QLineEdit(self.config['metagen_worker'].get('model_name', ''))
         meta_form.addRow("モデル名", self.model_name)
-        self.meta_wait_seconds = QSpinBox(); self.meta_wait_seconds.setRange(0, 600)
-        self.meta_wait_seconds.setValue(self.config['metagen_worker'].get('wait_seconds_if_no_job', 5))
-        meta_form.addRow("待機秒数", self.meta_wait_seconds)
         meta_group.setLayout(meta_form)
         layout.addWidget(meta_group)
         # 共通
@@ -460,10 +666,11 @@ class SettingsDialog(QDialog):
             self.accept()
     def get_config(self):
         # record_worker
+        # 起動時の整合性チェック (device_index_resolver) と照合できるよう、名前は表示名ではなく開いた時点のPyAudioから引いた生の名前で保存する
         self.config['record_worker']['vc_device_index'] = self.vc_combo.currentData()
-        self.config['record_worker']['vc_device_name'] = self.vc_combo.currentText().split(': ',1)[1] if ': ' in self.vc_combo.currentText() else self.vc_combo.currentText()
+        self.config['record_worker']['vc_device_name'] = self.pa.get_device_info_by_index(self.vc_combo.currentData())["name"] if self.vc_combo.currentData() is not None else ""
         self.config['record_worker']['mic_device_index'] = self.mic_combo.currentData()
-        self.config['record_worker']['mic_device_name'] = self.mic_combo.currentText().split(': ',1)[1] if ': ' in self.mic_combo.currentText() else self.mic_combo.currentText()
+        self.config['record_worker']['mic_device_name'] = self.pa.get_device_info_by_index(self.mic_combo.currentData())["name"] if self.mic_combo.currentData() is not None else ""
         self.config['record_worker']['monoral_mic'] = self.monoral_mic.isChecked()
         self.config['record_worker']['rate'] = self.rate.value()
         self.config['record_worker']['chunk'] = self.chunk.value()
@@ -472,11 +679,9 @@ class SettingsDialog(QDialog):
         self.config['transcribe_worker']['model_size'] = self.model_size.text()
         self.config['transcribe_worker']['device'] = self.device.text()
         self.config['transcribe_worker']['compute_type'] = self.compute_type.text()
-        self.config['transcribe_worker']['wait_seconds_if_no_job'] = self.wait_seconds.value()
         # metagen_worker
         self.config['metagen_worker']['api_key'] = self.api_key.text()
         self.config['metagen_worker']['model_name'] = self.model_name.text()
-        self.config['metagen_worker']['wait_seconds_if_no_job'] = self.meta_wait_seconds.value()
         # 共通
         self.config['db_path'] = self.db_path.text()
         self.config['base_dir'] = self.base_dir.text()
@@ -501,7 +706,6 @@ class BackendApp:
             if msg.clickedButton() == repair_btn:
                 # バックアップして初期化
                 if os.path.exists(config_path):
-                    import shutil
                     shutil.copy2(config_path, config_path+".bak")
                 self.config = setup_module.SetupWizard().collect_config() if hasattr(setup_module, 'SetupWizard') else {}
                 with open(config_path, 'w', encoding='utf-8') as f:
@@ -561,6 +765,8 @@ class BackendApp:
                     msg.setDefaultButton(retry_btn)
                     msg.exec()
                     if msg.clickedButton() == retry_btn:
+                        # 再選択までにデバイスが接続されたかもしれないので列挙し直す
+                        pa = reinit_pyaudio(pa)
                         continue
                     elif msg.clickedButton() == init_btn:
                         # config初期化
@@ -571,36 +777,82 @@ class BackendApp:
                     else:
                         print("デバイス選択がキャンセルされました。終了します。", file=sys.stderr)
                         sys.exit(1)
+        pa.terminate(); enumerate_devices.cache_clear(); device_name_map.cache_clear()
 
-        self.result_queue = multiprocessing.Queue(); self.command_queues = {}; self.workers = {}
-        self.db_manager = DatabaseManager(self.config['db_path'])
-        self.listener = EventListener(self.db_manager, self.result_queue, self.command_queues)
+        # GUI(PySide6)やPyAudioを読み込んだ親をforkしないよう、どのOSでもspawnで起動する
+        self.mp_ctx = multiprocessing.get_context("spawn")
+        # 結果通知はワーカーごとの単方向Pipeで受け取る (共有Queueのロックを奪い合わない)
+        # GUIスレッドなどメインプロセス内からのイベントは、専用のPipeにresult_queue.put()で送る
+        control_conn, self.result_queue = create_result_channel(self.mp_ctx)
+        self.result_conns = [control_conn]; self.command_queues = {}; self.workers = {}
+        self.db_manager = self.open_database(self.config['db_path'])
+        self.listener = EventListener(self.db_manager, self.result_conns, self.command_queues)
+    def open_database(self, db_path: str) -> DatabaseManager:
+        """DBを開く。失敗した場合はユーザーに修復・初期化・終了を選ばせる。"""
+        try:
+            return DatabaseManager(db_path)
+        except DBLockedError as e:
+            QMessageBox.critical(None, "DBファイルロック", f"DBファイルがロックされているか、アクセスできません:\n{e}\n他のプロセスで開いていないか確認してください。")
+            sys.exit(1)
+        except DBCorruptError as e:
+            msg = QMessageBox()
+            msg.setWindowTitle("DBエラー")
+            msg.setText(f"DBファイルのオープンに失敗しました: {e}\n修復または初期化しますか？")
+            repair_btn = msg.addButton("修復(バックアップ後新規作成)", QMessageBox.ButtonRole.AcceptRole)
+            init_btn = msg.addButton("初期化(新規作成)", QMessageBox.ButtonRole.DestructiveRole)
+            quit_btn = msg.addButton("終了", QMessageBox.ButtonRole.RejectRole)
+            msg.setDefaultButton(repair_btn)
+            msg.exec()
+            if msg.clickedButton() == repair_btn:
+                # コピーせずにリネームで退避する (同一ファイルシステム上ならサイズによらず一瞬で終わる)
+                suffix = time.strftime(".bak.%Y%m%d-%H%M%S")
+                for path in (db_path, db_path+"-wal", db_path+"-shm"):
+                    if os.path.exists(path): os.replace(path, path+suffix)
+                return DatabaseManager(db_path)
+            elif msg.clickedButton() == init_btn:
+                for path in (db_path, db_path+"-wal", db_path+"-shm"):
+                    if os.path.exists(path): os.remove(path)
+                return DatabaseManager(db_path)
+            else:
+                sys.exit(1)
     def run(self):
         worker_defs = {
             "RecordWorker-1": (record_worker, self.config['record_worker']),
             "TranscribeWorker-1": (transcribe_worker, self.config['transcribe_worker']),
             "MetaGenWorker-1": (metagen_worker, self.config['metagen_worker']),
         }
+        worker_conns = []
         for name, (target, cfg) in worker_defs.items():
-            cmd_q = multiprocessing.Queue(); self.command_queues[name] = cmd_q
+            # 指令は1対1なのでQueueではなく単方向Pipeで送る
+            self.command_queues[name], cmd_q = create_command_channel(self.mp_ctx); worker_conns.append(cmd_q)
+            result_conn, result_q = create_result_channel(self.mp_ctx); self.result_conns.append(result_conn); worker_conns.append(result_q)
             if name == "RecordWorker-1":
                 # record_worker: (result_queue, command_queue, base_dir, vc_device_index, mic_device_index, monoral_mic, rate, chunk, record_seconds, audio_format, timezone_str)
-                args = (self.result_queue, cmd_q, self.config['base_dir'], 
+                args = (result_q, cmd_q, self.config['base_dir'], 
                        cfg['vc_device_index'], cfg['mic_device_index'], cfg['monoral_mic'], 
                        cfg['rate'], cfg['chunk'], cfg['record_seconds'])
             elif name == "TranscribeWorker-1":
-                # transcribe_worker: (result_queue, command_queue, model_size, device, compute_type, wait_seconds)
-                args = (self.result_queue, cmd_q, cfg['model_size'], cfg['device'], 
-                       cfg['compute_type'], cfg['wait_seconds_if_no_job'])
+                # transcribe_worker: (result_queue, command_queue, model_size, device, compute_type, cpu_threads)
+                args = (result_q, cmd_q, cfg['model_size'], cfg['device'], 
+                       cfg['compute_type'], cfg.get('cpu_threads', 0))
             elif name == "MetaGenWorker-1":
-                # metagen_worker: (result_queue, command_queue, api_key, model_name, wait_seconds)
-                args = (self.result_queue, cmd_q, cfg['api_key'], cfg['model_name'], 
-                       cfg['wait_seconds_if_no_job'])
+                # metagen_worker: (result_queue, command_queue, api_key, model_name, max_concurrent_jobs)
+                args = (result_q, cmd_q, cfg['api_key'], cfg['model_name'], 
+                       cfg.get('max_concurrent_jobs', 1))
             else:
                 continue
-            process = multiprocessing.Process(target=target, args=args, name=name); process.start(); self.workers[name] = process
+            self.workers[name] = self.mp_ctx.Process(target=target, args=args, name=name)
+        # spawnの起動処理(子プロセスへの引き渡し)が直列にならないよう、全ワーカーを並行して起動する
+        with ThreadPoolExecutor(max_workers=len(self.workers) or 1) as executor:
+            list(executor.map(lambda process: process.start(), self.workers.values()))
+        # ワーカー側の端は引き渡し済みなので親では閉じる (ワーカー終了時に送信が詰まらず、結果側はEOFで終了を検知できるように)
+        for conn in worker_conns: conn.close()
         try: self.listener.listen()
         finally: self.stop()
+    def request_stop(self):
+        """リスナーに終了を伝えるだけ(ブロックしない)。後片付けはバックエンドスレッド側のstop()で行われる。"""
+        self.listener.is_running = False
+        self.result_queue.put({"event": Event.SHUTDOWN})
     def stop(self):
         self.listener.log("\n🧹 Cleaning up resources...")
         self.listener.is_running = False
@@ -620,43 +872,51 @@ class BackendApp:
 # -----------------------------------------------------------------------------
 
 class BackendSignals(QObject):
-    log_message = Signal(str)
-    worker_status_changed = Signal(str, int)  # worker_name, WorkerStatusの値
+    log_message = Signal(list)  # [(タイムスタンプ(epoch秒), メッセージ), ...]
+    worker_status_changed = Signal(dict)  # {worker_name: WorkerStatusの値}
 
 class BackendThread(QThread):
     def __init__(self, signals: BackendSignals):
         super().__init__(); self.backend_app = BackendApp(); self.backend_app.listener.signals = signals
     def run(self): self.backend_app.run()
-    def stop(self): self.backend_app.stop(); self.quit(); self.wait()
-
-class QuitThread(QThread):
-    finished_signal = Signal()
-    def __init__(self, backend_thread):
-        super().__init__()
-        self.backend_thread = backend_thread
-    def run(self):
-        self.backend_thread.stop()
-        self.finished_signal.emit()
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("VRChatVoiceJournal")
         self.setGeometry(100, 100, 800, 600)
-        self.setWindowIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaPlay))
+        # トグルのたびにスタイルからアイコンを引き直さないよう、使うものは最初に取得しておく
+        style = self.style()
+        self._icon_play = style.standardIcon(QStyle.StandardPixmap.SP_MediaPlay)
+        self._icon_pause = style.standardIcon(QStyle.StandardPixmap.SP_MediaPause)
+        self._icon_volume = style.standardIcon(QStyle.StandardPixmap.SP_MediaVolume)
+        self._icon_volume_muted = style.standardIcon(QStyle.StandardPixmap.SP_MediaVolumeMuted)
+        self._icon_stop = style.standardIcon(QStyle.StandardPixmap.SP_BrowserStop)
+        self._icon_reload = style.standardIcon(QStyle.StandardPixmap.SP_BrowserReload)
+        self.setWindowIcon(self._icon_play)
 
         self.is_mic_muted = False; self.is_recording_paused = False
         self.is_ai_paused = False
         self.is_quitting = False  # 終了中フラグ
+        # 設定ダイアログ用のPyAudio。デバイスの抜き差しを反映するため、ダイアログを開くたびに reinit_pyaudio() で作り直す
+        self._pa = None
 
         self.signals = BackendSignals()
         self.backend_thread = BackendThread(self.signals)
-        self.signals.log_message.connect(self.update_log)
-        self.signals.worker_status_changed.connect(self.update_worker_status)
+        # ワーカーからの通知は50ms単位でまとめてUIに反映する
+        self._pending_logs = []; self._pending_status = {}
+        self.ui_flush_timer = QTimer(self); self.ui_flush_timer.setSingleShot(True); self.ui_flush_timer.setInterval(50)
+        self.ui_flush_timer.timeout.connect(self.flush_ui_updates)
+        # ログは状態表示ほど即時性が要らないので100ms単位でまとめて追記する
+        self.log_flush_timer = QTimer(self); self.log_flush_timer.setSingleShot(True); self.log_flush_timer.setInterval(100)
+        self.log_flush_timer.timeout.connect(self.flush_logs)
+        self.signals.log_message.connect(self.queue_log)
+        self.signals.worker_status_changed.connect(self.queue_worker_status)
+        QApplication.instance().aboutToQuit.connect(self.on_about_to_quit)
 
         self.init_ui()
         self.init_tray_icon()
-        self.backend_thread.start()
+        # バックエンド(ワーカー起動)の開始はウィンドウ表示後に__main__から行う
 
     def init_ui(self):
         self.setStyleSheet(MODERN_STYLESHEET)
@@ -682,9 +942,9 @@ class MainWindow(QMainWindow):
         self.ai_pause_button = QPushButton("AI処理 一時停止"); self.ai_pause_button.setCheckable(True)
         
         # アイコンを設定
-        self.record_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaPause))
-        self.mute_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaVolumeMuted))
-        self.ai_pause_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_BrowserStop))
+        self.record_button.setIcon(self._icon_pause)
+        self.mute_button.setIcon(self._icon_volume_muted)
+        self.ai_pause_button.setIcon(self._icon_stop)
         
         control_v_layout.addWidget(self.record_button); control_v_layout.addWidget(self.mute_button); control_v_layout.addWidget(self.ai_pause_button)
         control_group.setLayout(control_v_layout)
@@ -697,18 +957,16 @@ class MainWindow(QMainWindow):
         
         right_pane = QWidget(); right_layout = QVBoxLayout(right_pane)
         status_group = QGroupBox("ワーカー状態"); status_layout = QHBoxLayout()
-        self.status_labels = {
-            "RecordWorker-1": QLabel(), "TranscribeWorker-1": QLabel(), "MetaGenWorker-1": QLabel()
-        }
-        self.restart_buttons = {}
-        for worker in self.status_labels:
+        # ワーカー名 -> (状態ラベル, 再起動ボタン, ラベル先頭の表示名HTML)
+        self._worker_ui = {}
+        for worker in ("RecordWorker-1", "TranscribeWorker-1", "MetaGenWorker-1"):
             vbox = QVBoxLayout()
-            vbox.addWidget(self.status_labels[worker])
+            label = QLabel(); vbox.addWidget(label)
             btn = QPushButton("再起動")
-            btn.clicked.connect(lambda _, w=worker: self.restart_worker(w))
+            btn.clicked.connect(functools.partial(self.restart_worker, worker))
             vbox.addWidget(btn)
             status_layout.addLayout(vbox)
-            self.restart_buttons[worker] = btn
+            self._worker_ui[worker] = (label, btn, f'<b>{worker.split("-")[0]}:</b> ')
         status_group.setLayout(status_layout)
         self.update_worker_status("RecordWorker-1", WorkerStatus.IDLE.value)
         self.update_worker_status("TranscribeWorker-1", WorkerStatus.IDLE.value)
@@ -723,7 +981,7 @@ class MainWindow(QMainWindow):
 
     def init_tray_icon(self):
         self.tray_icon = QSystemTrayIcon(self)
-        self.tray_icon.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaPlay))
+        self.tray_icon.setIcon(self._icon_play)
         self.tray_icon.setToolTip("VRChatVoiceJournal")
         tray_menu = QMenu()
         show_action = QAction("表示", self)
@@ -734,38 +992,61 @@ class MainWindow(QMainWindow):
         tray_menu.addAction(quit_action)
         self.tray_icon.setContextMenu(tray_menu); self.tray_icon.show()
 
+    def queue_log(self, entries: list):
+        self._pending_logs.extend(entries)
+        if not self.log_flush_timer.isActive(): self.log_flush_timer.start()
+
+    def queue_worker_status(self, statuses: dict):
+        # 同一ワーカーの連続した状態変化は最後の状態だけを反映する
+        self._pending_status.update(statuses)
+        if not self.ui_flush_timer.isActive(): self.ui_flush_timer.start()
+
+    def flush_logs(self):
+        if self._pending_logs:
+            self.update_log("\n".join(f"{format_log_time(ts)} {msg}" for ts, msg in self._pending_logs)); self._pending_logs = []
+
+    def flush_ui_updates(self):
+        if self._pending_status:
+            for worker_name, status_value in self._pending_status.items(): self.update_worker_status(worker_name, status_value)
+            self._pending_status = {}
+
     def update_log(self, message: str):
-        self.log_browser.append(message)
+        # append()のリッチテキスト判定を避け、末尾にプレーンテキストとして一括挿入する
+        scroll_bar = self.log_browser.verticalScrollBar(); at_bottom = scroll_bar.value() == scroll_bar.maximum()
+        document = self.log_browser.document(); cursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        if not document.isEmpty(): cursor.insertBlock()
+        cursor.insertText(message)
+        if at_bottom: scroll_bar.setValue(scroll_bar.maximum())
 
     def update_worker_status(self, worker_name: str, status_value: int):
-        status = WorkerStatus(status_value)
-        if worker_name in self.status_labels:
-            label = self.status_labels[worker_name]
-            label.setText(f'<b>{worker_name.split("-")[0]}:</b> <b style="color:{WORKER_STATUS_COLOR[status]};">{WORKER_STATUS_TEXT[status]}</b>')
+        ui = self._worker_ui.get(worker_name)
+        if ui is not None:
+            ui[0].setText(ui[2] + _STATUS_HTML[status_value])
 
     def toggle_recording_pause(self):
         self.is_recording_paused = not self.is_recording_paused
         command = {"task": "pause"} if self.is_recording_paused else {"task": "resume"}
         self.record_button.setText("録音 再開" if self.is_recording_paused else "録音 一時停止")
-        self.record_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaPlay if self.is_recording_paused else QStyle.StandardPixmap.SP_MediaPause))
+        self.record_button.setIcon(self._icon_play if self.is_recording_paused else self._icon_pause)
         self.backend_thread.backend_app.command_queues["RecordWorker-1"].put(command)
 
     def toggle_mic_mute(self):
         self.is_mic_muted = not self.is_mic_muted
         command = {"task": "mic_mute"} if self.is_mic_muted else {"task": "mic_unmute"}
         self.mute_button.setText("マイク ミュート 解除" if self.is_mic_muted else "マイク ミュート")
-        self.mute_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaVolume if self.is_mic_muted else QStyle.StandardPixmap.SP_MediaVolumeMuted))
+        self.mute_button.setIcon(self._icon_volume if self.is_mic_muted else self._icon_volume_muted)
         self.backend_thread.backend_app.command_queues["RecordWorker-1"].put(command)
 
     def toggle_ai_pause(self):
         self.is_ai_paused = not self.is_ai_paused
         self.ai_pause_button.setText("AI処理 再開" if self.is_ai_paused else "AI処理 一時停止")
-        self.ai_pause_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_BrowserReload if self.is_ai_paused else QStyle.StandardPixmap.SP_BrowserStop))
-        self.backend_thread.backend_app.result_queue.put({"event": "toggle_ai_pause"})
+        self.ai_pause_button.setIcon(self._icon_reload if self.is_ai_paused else self._icon_stop)
+        self.backend_thread.backend_app.result_queue.put({"event": Event.TOGGLE_AI_PAUSE})
 
     def open_settings_dialog(self):
-        pa = pyaudio.PyAudio()
-        dlg = SettingsDialog(self.backend_thread.backend_app.config, pa, self)
+        self._pa = reinit_pyaudio(self._pa)
+        dlg = SettingsDialog(self.backend_thread.backend_app.config, self._pa, self)
         if dlg.exec() == QDialog.DialogCode.Accepted:
             new_config = dlg.get_config()
             old_config = self.backend_thread.backend_app.config
@@ -786,23 +1067,26 @@ class MainWindow(QMainWindow):
                 self.restart_worker(worker)
             if changed_workers:
                 QMessageBox.information(self, "再起動", f"{', '.join(changed_workers)} を再起動しました。")
-    def restart_worker(self, worker_name):
+    def restart_worker(self, worker_name, _checked=False):
+        # _checked: 再起動ボタンのclicked(bool)からpartial経由で渡される値(未使用)
         # ワーカーを停止して再起動
         app = self.backend_thread.backend_app
-        if worker_name in app.workers:
-            # 停止
-            app.command_queues[worker_name].put({"task": "stop"})
-            app.workers[worker_name].join(timeout=10)
-            if app.workers[worker_name].is_alive():
-                app.workers[worker_name].terminate()
-                app.workers[worker_name].join(timeout=5)
-            if app.workers[worker_name].is_alive():
-                import signal
-                try:
-                    app.workers[worker_name].kill()
-                except Exception:
-                    pass
-                app.workers[worker_name].join(timeout=2)
+        proc = app.workers.get(worker_name)
+        if proc is None: return
+        app.command_queues[worker_name].put({"task": "stop"})
+        # join/terminate/killは最悪十数秒かかるので、GUIスレッドを止めないようスレッドプールで待つ
+        QThreadPool.globalInstance().start(functools.partial(self._graceful_kill, worker_name, proc))
+
+    def _graceful_kill(self, worker_name, proc):
+        # スレッドプール上で実行される。終了はsentinelで待つ(is_aliveでプロセス状態を問い合わせ直さない)
+        # select.selectはWindowsではソケットにしか使えないので、sentinelを待てるconnection.waitを使う
+        if not multiprocessing.connection.wait([proc.sentinel], timeout=10):
+            proc.terminate()
+            if not multiprocessing.connection.wait([proc.sentinel], timeout=5):
+                try: proc.kill()
+                except Exception: pass
+        proc.join(timeout=2)
+        self.signals.worker_status_changed.emit({worker_name: WorkerStatus.PAUSED.value})
 
     def closeEvent(self, event):
         if self.is_quitting:
@@ -822,49 +1106,71 @@ class MainWindow(QMainWindow):
         msg.exec()
         if msg.clickedButton() == yes_btn:
             self.is_quitting = True
-            self.quit_thread = QuitThread(self.backend_thread)
-            self.quit_thread.finished_signal.connect(QApplication.quit)
-            self.quit_thread.start()
+            # 後片付け(ワーカーのjoin)はバックエンドスレッドが行うので、GUIスレッドは終了をポーリングで待つだけ
+            self.backend_thread.backend_app.request_stop()
+            QTimer.singleShot(50, self._check_backend_stopped)
         elif msg.clickedButton() == minimize_btn:
             self.hide()
 
-def fix_encoding(name):
-    m = re.match(r"^(.*?)(\((.*?)\))?$", name)
-    if m:
-        outer = m.group(1)
-        paren = m.group(2)
-        inner = m.group(3)
-        try:
-            outer_fixed = outer.encode("cp932").decode("utf-8")
-        except Exception:
-            outer_fixed = outer
-        if inner is not None:
-            try:
-                inner_fixed = inner.encode("cp932").decode("utf-8")
-            except Exception:
-                inner_fixed = inner
-            paren_fixed = f"({inner_fixed})"
-        else:
-            paren_fixed = ""
-        return f"{outer_fixed}{paren_fixed}"
-    else:
-        try:
-            return name.encode("cp932").decode("utf-8")
-        except Exception:
-            return name
+    def _check_backend_stopped(self):
+        if self.backend_thread.isRunning():
+            QTimer.singleShot(50, self._check_backend_stopped)
+            return
+        if self._pa is not None: self._pa.terminate()
+        QApplication.quit()
 
-def device_index_resolver(pa, saved_index, saved_name):
+    def on_about_to_quit(self):
+        # 終了ダイアログを経ずにアプリが終了する場合(セッション終了など)もバックエンドを止めてから抜ける
+        if self.backend_thread.isRunning():
+            self.backend_thread.backend_app.request_stop()
+            self.backend_thread.wait()
+
+def _decode_cp932_mojibake(text):
+    # ASCIIだけの文字列はcp932→utf-8で変化しないので、例外処理の経路に入る前に返す
+    if text.isascii(): return text
     try:
-        info = pa.get_device_info_by_index(saved_index)
-        if info["name"] == saved_name:
-            return saved_index
-    except Exception:
-        pass
+        return text.encode("cp932").decode("utf-8")
+    except UnicodeError:
+        return text
+
+@functools.lru_cache(maxsize=256)
+def fix_encoding(name):
+    # "外側(内側)" の形なら外側と内側を別々に修正する (正規表現を使わず文字列操作だけで分割)
+    outer, paren, rest = name.partition("(")
+    if paren and rest.endswith(")"):
+        return f"{_decode_cp932_mojibake(outer)}({_decode_cp932_mojibake(rest[:-1])})"
+    return _decode_cp932_mojibake(name)
+
+@functools.lru_cache(maxsize=1)
+def enumerate_devices(pa):
+    """PyAudioインスタンスごとにデバイス一覧 (index, 生の名前, 表示名) を一度だけ列挙してキャッシュする。
+    デバイス構成の変化を拾うときは reinit_pyaudio() でPyAudioごと作り直し、キャッシュも破棄すること。"""
+    devices = []
     for i in range(pa.get_device_count()):
-        info = pa.get_device_info_by_index(i)
-        if info["name"] == saved_name:
-            return i
-    return None
+        name = pa.get_device_info_by_index(i)["name"]
+        devices.append((i, name, fix_encoding(name)))
+    return devices
+
+@functools.lru_cache(maxsize=1)
+def device_name_map(pa):
+    """生のデバイス名 -> index (同名デバイスが複数あれば最初のもの)"""
+    name_map = {}
+    for i, name, _ in enumerate_devices(pa):
+        name_map.setdefault(name, i)
+    return name_map
+
+def reinit_pyaudio(pa):
+    """PortAudioはPa_Initialize時点のデバイス一覧しか返さないので、終了して作り直す (抜き差しされたデバイスを反映する)。
+    古いインスタンスに紐づく列挙結果のキャッシュもあわせて破棄する。"""
+    if pa is not None: pa.terminate()
+    enumerate_devices.cache_clear(); device_name_map.cache_clear()
+    return pyaudio.PyAudio()
+
+def device_index_resolver(pa, saved_index, saved_name):
+    devices = enumerate_devices(pa)
+    if isinstance(saved_index, int) and 0 <= saved_index < len(devices) and devices[saved_index][1] == saved_name:
+        return saved_index
+    return device_name_map(pa).get(saved_name)
 
 if __name__ == "__main__":
     multiprocessing.freeze_support()
@@ -875,38 +1181,13 @@ if __name__ == "__main__":
         # サブプロセスでsetup.pyをウィンドウ非表示で実行
         kwargs = {}
         if sys.platform == 'win32':
-            import subprocess
             kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
         ret = subprocess.run([sys.executable, 'setup.py'], **kwargs)
         if not os.path.exists(config_path):
             print('config.jsonの生成に失敗しました。', file=sys.stderr)
             sys.exit(1)
-    try:
-        import pyaudio
-    except ImportError:
-        from PySide6.QtWidgets import QApplication, QMessageBox
-        import sys
-        app = QApplication.instance() or QApplication(sys.argv)
-        QMessageBox.critical(None, "PyAudio未導入", "PyAudioライブラリがインストールされていません。\npip install pyaudio を実行してください。")
-        sys.exit(1)
-    try:
-        import setup as setup_module
-    except ImportError:
-        from PySide6.QtWidgets import QApplication, QMessageBox
-        import sys
-        app = QApplication.instance() or QApplication(sys.argv)
-        QMessageBox.critical(None, "setup.py未導入", "setup.pyが見つかりません。初期セットアップをやり直してください。")
-        sys.exit(1)
-    try:
-        from workers.record_worker import record_worker
-        from workers.transcribe_worker import transcribe_worker
-        from workers.metagen_worker import metagen_worker
-    except ImportError as e:
-        from PySide6.QtWidgets import QApplication, QMessageBox
-        import sys
-        app = QApplication.instance() or QApplication(sys.argv)
-        QMessageBox.critical(None, "ワーカー未導入", f"ワーカーモジュールのインポートに失敗しました:\n{e}\n必要なファイルが揃っているか確認してください。")
-        sys.exit(1)
     window = MainWindow()
     window.show()
+    # ウィンドウを先に描画させ、ワーカーの起動(モデル読み込みなど)はイベントループ開始後に回す
+    QTimer.singleShot(0, window.backend_thread.start)
     sys.exit(app.exec())
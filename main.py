@@ -2,17 +2,24 @@
 import sqlite3
 import json
 import multiprocessing
+from multiprocessing.connection import Connection, wait
 import sys
-from queue import Empty
+import signal
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from enum import IntEnum
-from typing import Dict, Any, Optional, Tuple
-import uuid
+from typing import Deque, Dict, Any, List, Optional, Tuple
+from pathlib import Path
 
 # 外部ワーカーのインポート
 # workersフォルダが同じ階層にあることを想定
 from workers.record_worker import record_worker
 from workers.transcribe_worker import transcribe_worker
 from workers.metagen_worker import metagen_worker
+from workers.command_channel import CommandChannel, create_command_channel, create_result_channel, recv_into
+from workers.events import Event
 
 # --- 設定ファイル検証 ---
 def validate_config(config: Dict[str, Any]):
@@ -21,9 +28,9 @@ def validate_config(config: Dict[str, Any]):
         raise KeyError("トップレベルの必須キーが不足しています。")
     if not all(k in config["record_worker"] for k in ["vc_device_index", "mic_device_index"]):
         raise KeyError("record_workerの必須キーが不足しています。")
-    if not all(k in config["transcribe_worker"] for k in ["model_size", "device", "compute_type", "wait_seconds_if_no_job"]):
+    if not all(k in config["transcribe_worker"] for k in ["model_size", "device", "compute_type"]):
         raise KeyError("transcribe_workerの必須キーが不足しています。")
-    if not all(k in config["metagen_worker"] for k in ["api_key", "model_name", "wait_seconds_if_no_job"]):
+    if not all(k in config["metagen_worker"] for k in ["api_key", "model_name"]):
         raise KeyError("metagen_workerの必須キーが不足しています。")
 
 # --- アプリケーションの状態を定義するEnum ---
@@ -33,87 +40,268 @@ class Status(IntEnum):
     PENDING = 0
     TRANSCRIBE_DONE = 1
     META_DONE = 2
+# クエリのパラメータに毎回.valueを引かずに済むよう、よく使う値は素のintで持っておく
+_STATUS_PENDING, _STATUS_TRANSCRIBE_DONE = int(Status.PENDING), int(Status.TRANSCRIBE_DONE)
+
+# --- 頻繁に実行するSQL (同一オブジェクトを使い回してステートメントキャッシュに確実にヒットさせる) ---
+# 同じステータスへ遷移するセッションをまとめて1文で更新する (プレースホルダ数ごとに文字列を使い回す)
+_SQL_UPDATE_STATUS_IN = "UPDATE recordings SET status = ? WHERE id IN ({})"
+_update_status_sql_cache: Dict[int, str] = {}
+
+def _update_status_sql(count: int) -> str:
+    sql = _update_status_sql_cache.get(count)
+    if sql is None:
+        sql = _update_status_sql_cache[count] = _SQL_UPDATE_STATUS_IN.format(", ".join("?" * count))
+    return sql
+_SQL_FIND_PENDING_TRANSCRIBE = """
+    SELECT id, file_path FROM recordings
+    WHERE status = ?
+    ORDER BY start_time ASC
+    LIMIT ?
+"""
+_SQL_FIND_PENDING_META = """
+    SELECT r.id, t.segments_json
+    FROM recordings r
+    JOIN transcribes t ON r.id = t.id
+    WHERE r.status = ?
+    ORDER BY r.start_time ASC
+    LIMIT ?
+"""
+_SQL_INSERT_RECORDING = "INSERT OR REPLACE INTO recordings (id, start_time, length, file_path, status) VALUES (?, ?, ?, ?, ?)"
+_SQL_INSERT_TRANSCRIBE = "INSERT OR REPLACE INTO transcribes (id, segments_json) VALUES (?, ?)"
+# markers/tagsのidはINTEGER PRIMARY KEY(rowid)なのでSQLiteに採番させる
+_SQL_INSERT_MARKER = "INSERT INTO markers (session_id, timestamp, label) VALUES (?, ?, ?)"
+_SQL_INSERT_TAG = "INSERT INTO tags (session_id, tag) VALUES (?, ?)"
+# 保留バッファと挿入文の対応。外部キーを満たすよう、この順で書き込む
+_PENDING_INSERTS = (
+    ('recordings', _SQL_INSERT_RECORDING),
+    ('transcribes', _SQL_INSERT_TRANSCRIBE),
+    ('markers', _SQL_INSERT_MARKER),
+    ('tags', _SQL_INSERT_TAG),
+)
+
+# 未処理ジョブをDBから引くとき、1回のSELECTでまとめて先読みする件数
+JOB_PREFETCH_SIZE = 8
+
+# バックグラウンドでWALをチェックポイントする間隔(秒)
+WAL_CHECKPOINT_INTERVAL = 30
+
+# 保留中のステータス更新がこの件数に達したら、バッチの途中でも書き込む
+STATUS_FLUSH_THRESHOLD = 64
+
+# 未処理ジョブ検索用の索引が既にあるか (無ければ作成後にANALYZEする)
+_SQL_FIND_JOB_INDEX = "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_recordings_status_starttime_id'"
+
+# 以前はTEXTのUUIDをidにしていたテーブルと、移行時にコピーする列
+_LEGACY_ID_TABLES = {"markers": "session_id, timestamp, label", "tags": "session_id, tag"}
+_SQL_TABLE_EXISTS = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+
+# スキーマ。移行と同じトランザクションで作れるよう、executescriptではなく1文ずつ実行する
+_SCHEMA_TABLES = (
+    """CREATE TABLE IF NOT EXISTS recordings (
+        id TEXT PRIMARY KEY, start_time TEXT NOT NULL, length REAL,
+        file_path TEXT, status INTEGER NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS transcribes (
+        id TEXT PRIMARY KEY, segments_json TEXT,
+        FOREIGN KEY (id) REFERENCES recordings (id))""",
+    """CREATE TABLE IF NOT EXISTS markers (
+        id INTEGER PRIMARY KEY, session_id TEXT NOT NULL, timestamp REAL NOT NULL,
+        label TEXT, FOREIGN KEY (session_id) REFERENCES recordings (id))""",
+    """CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY, session_id TEXT NOT NULL, tag TEXT NOT NULL,
+        FOREIGN KEY (session_id) REFERENCES recordings (id))""",
+)
+_SCHEMA_INDEXES = (
+    # 未処理ジョブ検索 (WHERE status = ? ORDER BY start_time) 用の複合インデックス
+    # idまで含めておくと、メタデータ生成ジョブ検索はrecordings本体を読まずに索引だけで済む
+    "DROP INDEX IF EXISTS idx_recordings_status_starttime",
+    "CREATE INDEX IF NOT EXISTS idx_recordings_status_starttime_id ON recordings(status, start_time, id)",
+    "CREATE INDEX IF NOT EXISTS idx_markers_session ON markers(session_id)",
+    "CREATE INDEX IF NOT EXISTS idx_tags_session ON tags(session_id)",
+)
 
 # --- データベース管理クラス ---
 class DatabaseManager:
     def __init__(self, db_path: str):
-        self.conn: sqlite3.Connection = sqlite3.connect(db_path)
+        # 書き込み用接続。INSERT/UPDATEはすべてこちらを通す
+        self.conn: sqlite3.Connection = sqlite3.connect(db_path, cached_statements=256)
+        # イベントごとにコミットせず、flush()でまとめて書き込むための保留バッファ
+        self._pending: Dict[str, List[tuple]] = {'recordings': [], 'transcribes': [], 'markers': [], 'tags': []}
+        # session_id -> 最後に遷移したステータス。途中の遷移は最終値で上書きされる
+        self._pending_status: Dict[str, int] = {}
         self._init_db()
+        # 未処理ジョブ検索用の読み取り専用接続 (WALなので書き込みトランザクションと並行して読める)
+        self.read_conn: sqlite3.Connection = sqlite3.connect(
+            Path(db_path).resolve().as_uri() + "?mode=ro", uri=True, cached_statements=256
+        )
+        # WALの書き戻しはリスナーのコミット中ではなく、専用スレッドで定期的に行う
+        self.db_path = db_path
+        self._checkpoint_stop = threading.Event()
+        self._checkpointer = threading.Thread(target=self._checkpoint_loop, name="WALCheckpointer", daemon=True)
+        self._checkpointer.start()
 
     def _init_db(self):
         print("Initializing database...")
-        self.conn.execute("PRAGMA journal_mode=WAL;")
-        cursor = self.conn.cursor()
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS recordings (
-            id TEXT PRIMARY KEY, start_time TEXT NOT NULL, length REAL,
-            file_path TEXT, status INTEGER NOT NULL);
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS transcribes (
-            id TEXT PRIMARY KEY, segments_json TEXT,
-            FOREIGN KEY (id) REFERENCES recordings (id));
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS markers (
-            id TEXT PRIMARY KEY, session_id TEXT NOT NULL, timestamp REAL NOT NULL,
-            label TEXT, FOREIGN KEY (session_id) REFERENCES recordings (id));
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS tags (
-            id TEXT PRIMARY KEY, session_id TEXT NOT NULL, tag TEXT NOT NULL,
-            FOREIGN KEY (session_id) REFERENCES recordings (id));
+        # WAL + synchronous=NORMAL: クラッシュ時に直近数件のイベントが失われる可能性はあるが、DBの整合性は保たれる
+        self.conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=268435456;
+        PRAGMA wal_autocheckpoint=1000;
+        PRAGMA busy_timeout=5000;
+        PRAGMA foreign_keys=ON;
         """)
-        self.conn.commit()
+        # 未処理ジョブ検索用の索引を作り直す場合は、統計を取り直してプランナーに使わせる
+        need_analyze = self.conn.execute(_SQL_FIND_JOB_INDEX).fetchone() is None
+        # idがTEXTの旧テーブルは退避しておき、新しいスキーマで作り直してから中身を移す。
+        # 退避・作成・コピー・削除は1つのトランザクションで行い、途中で終了しても移行前の状態に戻るようにする
+        with self.write_txn():
+            legacy = [table for table in _LEGACY_ID_TABLES
+                      if any(col[1] == 'id' and col[2].upper() == 'TEXT'
+                             for col in self.conn.execute(f"PRAGMA table_info({table})"))]
+            for table in legacy:
+                self.conn.execute(f"DROP INDEX IF EXISTS idx_{table}_session")
+                self.conn.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+            for sql in _SCHEMA_TABLES:
+                self.conn.execute(sql)
+            # 以前の版で移行が途中で止まり、退避先だけが残っている場合もここでコピーを済ませる
+            for table, columns in _LEGACY_ID_TABLES.items():
+                if self.conn.execute(_SQL_TABLE_EXISTS, (f"{table}_legacy",)).fetchone() is None:
+                    continue
+                self.conn.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_legacy ORDER BY rowid")
+                self.conn.execute(f"DROP TABLE {table}_legacy")
+                print(f"Migrated '{table}' to integer ids.")
+            # 退避先のテーブルに残っていた同名の索引が消えてから作る
+            for sql in _SCHEMA_INDEXES:
+                self.conn.execute(sql)
+        if need_analyze:
+            self.conn.execute("ANALYZE")
         print("Database initialized.")
 
+    def _checkpoint_loop(self):
+        """PASSIVEチェックポイントを定期実行する。書き込み中なら待たずに、書き戻せる分だけ書き戻す。"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            while not self._checkpoint_stop.wait(WAL_CHECKPOINT_INTERVAL):
+                try:
+                    conn.execute("PRAGMA wal_checkpoint(PASSIVE);")
+                except sqlite3.Error as e:
+                    print(f"[WARNING] WAL checkpoint failed: {e}")
+        finally:
+            conn.close()
+
     def close(self):
+        self._checkpoint_stop.set()
+        self._checkpointer.join()
         if self.conn:
+            self.flush()
+            self.read_conn.close()
             self.conn.close()
             print("Database connection closed.")
 
     def _update_status(self, session_id: str, status: Status):
-        with self.conn:
-            self.conn.execute("UPDATE recordings SET status = ? WHERE id = ?", (status.value, session_id))
-
-    def find_pending_transcribe_job(self) -> Optional[Tuple[str, str]]:
-        """ステータスがPENDINGの文字起こしジョブを1件探して返す。"""
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT id, file_path FROM recordings WHERE status = ? ORDER BY start_time ASC LIMIT 1",
-            (Status.PENDING.value,)
-        )
-        return cursor.fetchone()
+        self._pending_status[session_id] = status.value
+        if len(self._pending_status) >= STATUS_FLUSH_THRESHOLD:
+            self.flush()
+
+    @contextmanager
+    def write_txn(self):
+        """書き込みトランザクション。BEGIN IMMEDIATEで最初に書き込みロックを取り、途中でのロック昇格待ちを避ける。"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
+    def flush(self):
+        """溜めておいた書き込みを1トランザクションでまとめてコミットする。"""
+        pending = self._pending
+        pending_status = self._pending_status
+        if not pending_status and not any(pending.values()):
+            return
+        # ステータスごとにsession_idをまとめ、UPDATE ... WHERE id IN (...) 1文ずつにする
+        status_groups: Dict[int, List[str]] = {}
+        for session_id, status in pending_status.items():
+            status_groups.setdefault(status, []).append(session_id)
+        try:
+            with self.write_txn():
+                for key, sql in _PENDING_INSERTS:
+                    self.conn.executemany(sql, pending[key])
+                # ステータス更新は行の挿入後に適用する
+                for status, session_ids in status_groups.items():
+                    self.conn.execute(_update_status_sql(len(session_ids)), (status, *session_ids))
+        except sqlite3.Error as e:
+            # ロールバックされたので、1行ずつ書き直して失敗した行だけを捨てる
+            print(f"[WARNING] Batched DB write failed, retrying row by row: {e}")
+            self._flush_one_by_one()
+            return
+        # バッファはコミットに成功してから空にする
+        for rows in pending.values():
+            rows.clear()
+        pending_status.clear()
+
+    def _flush_one_by_one(self):
+        """
+        保留中の行とステータス更新を1件ずつ別トランザクションで書き込む。
+        制約違反など、その行自体が原因の失敗はその行だけを捨てる。
+        ロック待ちのタイムアウトは他の行も同じく失敗するので、残りはすべて次のflush()まで持ち越す。
+        """
+        def write(sql: str, params: tuple, session_id: str) -> Optional[bool]:
+            """書き込めればTrue、行を捨てるならFalse、持ち越すならNoneを返す。"""
+            try:
+                with self.write_txn():
+                    self.conn.execute(sql, params)
+                return True
+            except sqlite3.Error as e:
+                if isinstance(e, sqlite3.OperationalError) and ("locked" in str(e) or "busy" in str(e)):
+                    return None
+                print(f"[ERROR] Dropped DB write for session {session_id}: {e}")
+                return False
+
+        # 各行の先頭はsession_id
+        for key, sql in _PENDING_INSERTS:
+            rows = self._pending[key]
+            while rows:
+                if write(sql, rows[0], rows[0][0]) is None:
+                    return
+                rows.pop(0)
+        pending_status = self._pending_status
+        while pending_status:
+            session_id, status = next(iter(pending_status.items()))
+            if write(_update_status_sql(1), (status, session_id), session_id) is None:
+                return
+            del pending_status[session_id]
+
+    def find_pending_transcribe_jobs(self, limit: int) -> List[Tuple[str, str]]:
+        """ステータスがPENDINGの文字起こしジョブを古い順に最大limit件返す。"""
+        self.flush()
+        return self.read_conn.execute(_SQL_FIND_PENDING_TRANSCRIBE, (_STATUS_PENDING, limit)).fetchall()
     
-    def find_pending_meta_job(self) -> Optional[Tuple[str, str]]:
-        """ステータスがTRANSCRIBE_DONEのメタデータ生成ジョブを探して返す。"""
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT r.id, t.segments_json
-            FROM recordings r
-            JOIN transcribes t ON r.id = t.id
-            WHERE r.status = ? 
-            ORDER BY r.start_time ASC 
-            LIMIT 1
-        """, (Status.TRANSCRIBE_DONE.value,))
-        return cursor.fetchone()
+    def find_pending_meta_jobs(self, limit: int) -> List[Tuple[str, str]]:
+        """ステータスがTRANSCRIBE_DONEのメタデータ生成ジョブを古い順に最大limit件返す。"""
+        self.flush()
+        return self.read_conn.execute(_SQL_FIND_PENDING_META, (_STATUS_TRANSCRIBE_DONE, limit)).fetchall()
 
     def handle_record_done(self, message: Dict[str, Any]):
         payload = message.get('payload', {})
         session_id = payload.get('session_id')
-        with self.conn:
-            self.conn.execute(
-                "INSERT OR REPLACE INTO recordings (id, start_time, length, file_path, status) VALUES (?, ?, ?, ?, ?)",
-                (session_id, payload['start_time'], payload['length'], payload['file_path'], Status.PENDING.value)
-            )
+        self._pending['recordings'].append(
+            (session_id, payload['start_time'], payload['length'], payload['file_path'], _STATUS_PENDING)
+        )
 
     def handle_transcribe_done(self, message: Dict[str, Any]):
         payload = message.get('payload', {})
         session_id = payload.get('session_id', "")
-        with self.conn:
-            self.conn.execute("INSERT OR REPLACE INTO transcribes (id, segments_json) VALUES (?, ?)",
-                              (session_id, json.dumps(payload['segments_json'])))
-            self._update_status(session_id, Status.TRANSCRIBE_DONE)
+        segments_json = payload['segments_json']  # ワーカーからはJSON文字列で届く
+        # シリアライズは書き込みトランザクションの外で済ませる
+        if not isinstance(segments_json, str):
+            segments_json = json.dumps(segments_json, ensure_ascii=False, separators=(',', ':'))
+        self._pending['transcribes'].append((session_id, segments_json))
+        self._update_status(session_id, Status.TRANSCRIBE_DONE)
 
     def handle_meta_done(self, message: Dict[str, Any]):
         payload = message.get('payload', {})
@@ -125,105 +313,174 @@ class DatabaseManager:
             print("[ERROR] session_id is missing in meta_done payload.")
             return
 
-        with self.conn:
-            for marker in markers:
-                self.conn.execute(
-                    "INSERT INTO markers (id, session_id, timestamp, label) VALUES (?, ?, ?, ?)",
-                    (str(uuid.uuid4()), session_id, marker.get('time'), marker.get('content'))
-                )
-            for tag_text in tags:
-                self.conn.execute(
-                    "INSERT INTO tags (id, session_id, tag) VALUES (?, ?, ?)",
-                    (str(uuid.uuid4()), session_id, tag_text)
-                )
-            self._update_status(session_id, Status.META_DONE)
-            print(f"✅ Metadata stored for session {session_id}.")
+        self._pending['markers'].extend(
+            # markersはワーカーから (time, content) のタプルで届く
+            (session_id, marker_time, content) for marker_time, content in markers
+        )
+        self._pending['tags'].extend((session_id, tag_text) for tag_text in tags)
+        self._update_status(session_id, Status.META_DONE)
+        print(f"✅ Metadata queued for session {session_id}.")
 
     def handle_error(self, message: Dict[str, Any]):
         payload = message.get('payload', {})
         session_id = payload.get('session_id')
-        if session_id: self._update_status(session_id, Status.ERROR)
+        # retryが付いたエラー(通信失敗など)はERRORにせず、未処理のまま残して後で再試行させる
+        if session_id and not payload.get('retry'): self._update_status(session_id, Status.ERROR)
         print(f"🚨 [ERROR] from '{payload.get('worker')}': {payload.get('error_message')}")
 
 # --- イベントリスナークラス ---
 class EventListener:
-    def __init__(self, db_manager: DatabaseManager, result_queue: multiprocessing.Queue, command_queues: Dict[str, multiprocessing.Queue]):
+    def __init__(self, db_manager: DatabaseManager, result_conns: List[Connection], command_queues: Dict[str, CommandChannel]):
         self.db_manager = db_manager
-        self.result_queue = result_queue
+        # ワーカーごと(+メインプロセス自身)の結果通知用Pipeの受信側。届いたものから順に読む
+        self.result_conns = result_conns
         self.command_queues = command_queues
-        self.event_handlers = {
-            'record_done': self.db_manager.handle_record_done,
-            'transcribe_done': self.db_manager.handle_transcribe_done,
-            'meta_done': self.db_manager.handle_meta_done,
-            'error': self.db_manager.handle_error,
-            'request_transcribe_job': self.handle_transcribe_job_request,
-            'request_metagen_job': self.handle_meta_job_request,
+        # このプロセス内で完了したばかりのジョブ。DBを引かずにそのまま割り当てる
+        # (空のときだけDBを検索する。起動前から残っている未処理分はそちらで拾う)
+        self.transcribe_ready: Deque[Tuple[str, str]] = deque()
+        self.meta_ready: Deque[Tuple[str, str]] = deque()
+        # ジョブが無かったためにstandbyを返さず、指令待ちのまま保留しているワーカー名
+        self._waiting_transcribe: Optional[str] = None
+        # メタデータ生成ワーカーは複数のジョブを並行して処理するので、保留中の要求を1件ずつ積む
+        self._waiting_meta: Deque[str] = deque()
+        # 割り当て中のsession_id -> ワーカー名 (先読みしたジョブを二重に割り当てないため)
+        self._in_flight: Dict[str, str] = {}
+        handlers = {
+            Event.RECORD_DONE: self.handle_record_done,
+            Event.TRANSCRIBE_DONE: self.handle_transcribe_done,
+            Event.META_DONE: self.handle_meta_done,
+            Event.ERROR: self.handle_error,
+            Event.REQUEST_TRANSCRIBE_JOB: self.handle_transcribe_job_request,
+            Event.REQUEST_METAGEN_JOB: self.handle_meta_job_request,
         }
+        # Eventの値で直接インデックスするハンドラ表 (このCLI版で扱わないイベントはNone)
+        self.event_handlers = tuple(handlers.get(event) for event in Event)
+
+    def handle_record_done(self, message: Dict[str, Any]):
+        self.db_manager.handle_record_done(message)
+        payload = message.get('payload', {})
+        self.transcribe_ready.append((payload.get('session_id'), payload['file_path']))
+        self._dispatch_waiting()
+
+    def handle_transcribe_done(self, message: Dict[str, Any]):
+        self.db_manager.handle_transcribe_done(message)
+        payload = message.get('payload', {})
+        self._in_flight.pop(payload.get('session_id'), None)
+        self.meta_ready.append((payload.get('session_id', ""), payload['segments_json']))
+        self._dispatch_waiting()
+
+    def handle_meta_done(self, message: Dict[str, Any]):
+        self.db_manager.handle_meta_done(message)
+        self._in_flight.pop(message.get('payload', {}).get('session_id'), None)
+
+    def handle_error(self, message: Dict[str, Any]):
+        self.db_manager.handle_error(message)
+        session_id = message.get('payload', {}).get('session_id')
+        if session_id:
+            self._in_flight.pop(session_id, None)
+        else:
+            # session_idの無いエラーでも、そのワーカーに割り当て中の扱いは解く (次回の先読みで再試行される)
+            worker_name = message.get('worker')
+            for sid in [sid for sid, name in self._in_flight.items() if name == worker_name]:
+                del self._in_flight[sid]
+
+    def _next_job(self, ready: Deque[Tuple[str, str]], find_jobs) -> Optional[Tuple[str, str]]:
+        """手元のジョブが尽きていればDBからまとめて先読みし、先頭の1件を返す。"""
+        if not ready:
+            ready.extend(job for job in find_jobs(JOB_PREFETCH_SIZE) if job[0] not in self._in_flight)
+        return ready.popleft() if ready else None
+
+    def _dispatch_waiting(self):
+        """保留中のワーカーに、溜まっているジョブをこちらから割り当てる。"""
+        if self._waiting_transcribe and self.transcribe_ready:
+            worker_name, self._waiting_transcribe = self._waiting_transcribe, None
+            self._assign_transcribe_job(worker_name, self.transcribe_ready.popleft())
+        while self._waiting_meta and self.meta_ready:
+            self._assign_meta_job(self._waiting_meta.popleft(), self.meta_ready.popleft())
+
+    def _assign_transcribe_job(self, worker_name: str, job: Tuple[str, str]):
+        session_id, file_path = job
+        self._in_flight[session_id] = worker_name
+        print(f"🚚 Assigning transcribe job {session_id} to {worker_name}")
+        self.command_queues[worker_name].put({
+            "task": "transcribe",
+            "payload": {"session_id": session_id, "file_path": file_path}
+        })
+
+    def _assign_meta_job(self, worker_name: str, job: Tuple[str, str]):
+        session_id, segments_json_str = job
+        self._in_flight[session_id] = worker_name
+        # DBのJSON文字列をそのまま渡し、デコードはワーカー側で一度だけ行う
+        print(f"🚚 Assigning metagen job {session_id} to {worker_name}")
+        self.command_queues[worker_name].put({
+            "task": "generate_meta",
+            "payload": {"session_id": session_id, "segments_json": segments_json_str}
+        })
 
     def handle_transcribe_job_request(self, message: Dict[str, Any]):
         worker_name = message.get("worker", "")
-        command_queue = self.command_queues.get(worker_name)
-        if not command_queue: return
+        if worker_name not in self.command_queues: return
 
-        job = self.db_manager.find_pending_transcribe_job()
+        job = self._next_job(self.transcribe_ready, self.db_manager.find_pending_transcribe_jobs)
         if job:
-            session_id, file_path = job
-            print(f"🚚 Assigning transcribe job {session_id} to {worker_name}")
-            command_queue.put({
-                "task": "transcribe",
-                "payload": {"session_id": session_id, "file_path": file_path}
-            })
+            self._assign_transcribe_job(worker_name, job)
         else:
-            command_queue.put({"task": "standby"})
+            # standbyで待たせて再問い合わせさせる代わりに、次の録音完了時にこちらから割り当てる
+            self._waiting_transcribe = worker_name
 
     def handle_meta_job_request(self, message: Dict[str, Any]):
         worker_name = message.get("worker", "")
-        command_queue = self.command_queues.get(worker_name)
-        if not command_queue: return
+        if worker_name not in self.command_queues: return
 
-        job = self.db_manager.find_pending_meta_job()
+        job = self._next_job(self.meta_ready, self.db_manager.find_pending_meta_jobs)
         if job:
-            session_id, segments_json_str = job
-            try:
-                segments = json.loads(segments_json_str)
-                print(f"🚚 Assigning metagen job {session_id} to {worker_name}")
-                command_queue.put({
-                    "task": "generate_meta",
-                    "payload": {"session_id": session_id, "segments_json": segments}
-                })
-            except json.JSONDecodeError as e:
-                print(f"🚨 [ERROR] Failed to decode segments_json for session {session_id}: {e}")
-                error_message = {
-                    "event": "error",
-                    "payload": {
-                        'worker': 'EventListener', 
-                        'session_id': session_id,
-                        'error_message': f"segments_jsonのデコードに失敗: {e}"
-                    }
-                }
-                self.db_manager.handle_error(error_message)
+            self._assign_meta_job(worker_name, job)
         else:
-            command_queue.put({"task": "standby"})
+            # 次の文字起こし完了時にこちらから割り当てる
+            self._waiting_meta.append(worker_name)
+
+    def _process_message(self, message: Dict[str, Any]):
+        event = message.get('event')
+        if not (isinstance(event, int) and 0 <= event < len(self.event_handlers)):
+            print(f"🤔 [WARNING] Unknown event: '{event}'")
+            return
+        handler = self.event_handlers[event]
+        if handler:
+            try:
+                handler(message)
+            except Exception as e:
+                print(f"🚨 [ERROR] while handling '{Event(event).name}': {e}")
+
+    def _receive_batch(self) -> List[Dict[str, Any]]:
+        """どれかのPipeに届くまでブロックし、読めるPipeから届いている分をまとめて受け取る。"""
+        batch = []
+        for conn in wait(self.result_conns):
+            try:
+                recv_into(conn, batch)
+                while conn.poll():
+                    recv_into(conn, batch)
+            except EOFError:
+                # ワーカーが終了して送信側が閉じられた
+                self.result_conns.remove(conn)
+        return batch
 
     def listen(self):
         print("🎧 Event listener started...")
-        try:
-            while True:
-                try:
-                    message = self.result_queue.get(timeout=5)
-                    event = message.get('event', "")
-                    handler = self.event_handlers.get(event)
-                    if handler:
-                        try:
-                            handler(message)
-                        except Exception as e:
-                            print(f"🚨 [ERROR] while handling '{event}': {e}")
-                    else:
-                        print(f"🤔 [WARNING] Unknown event: '{event}'")
-                except Empty:
-                    continue
-        except KeyboardInterrupt:
-            print("\nShutdown signal received...")
+        running = True
+        while running:
+            # ポーリングせずにブロッキングで待機し、SIGINTで投入される番兵で抜ける
+            batch = self._receive_batch()
+            # 届いているイベントをまとめて処理し、DB書き込みは1回のコミットに集約する
+            for message in batch:
+                if message.get('event') == Event.SHUTDOWN:
+                    print("\nShutdown signal received...")
+                    running = False
+                    break
+                self._process_message(message)
+            try:
+                self.db_manager.flush()
+            except Exception as e:
+                print(f"🚨 [ERROR] while flushing database writes: {e}")
 
 # --- メイン実行ブロック ---
 def main():
@@ -235,7 +492,9 @@ def main():
         print(f"🚨 [FATAL] 設定ファイルに問題があります: {e}", file=sys.stderr)
         sys.exit(1)
 
-    result_queue = multiprocessing.Queue()
+    # 結果通知はワーカーごとの単方向Pipeで受け取る。Ctrl+Cの番兵はメインプロセス用のPipeに送る
+    control_conn, control_queue = create_result_channel()
+    result_conns = [control_conn]
     command_queues = {}
     db_manager = DatabaseManager(config['db_path'])
     workers = {}
@@ -244,41 +503,56 @@ def main():
         # レコードワーカーを起動
         rec_worker_name = "RecordWorker-1"
         rec_worker_cfg = config['record_worker']
-        rec_cmd_q = multiprocessing.Queue()
-        command_queues[rec_worker_name] = rec_cmd_q
+        command_queues[rec_worker_name], rec_cmd_q = create_command_channel()
+        rec_result_conn, rec_result_q = create_result_channel()
+        result_conns.append(rec_result_conn)
         rec_process = multiprocessing.Process(
-            target=record_worker, args=(result_queue, rec_cmd_q, config['base_dir'], *rec_worker_cfg.values()),
+            target=record_worker, args=(rec_result_q, rec_cmd_q, config['base_dir'], *rec_worker_cfg.values()),
             name=rec_worker_name)
         rec_process.start()
+        rec_cmd_q.close()  # 受信側はワーカーに引き渡し済み
+        rec_result_q.close()  # 送信側も同様 (閉じておくとワーカー終了をEOFで検知できる)
         workers[rec_worker_name] = rec_process
         print(f"🚀 Worker '{rec_worker_name}' started.")
 
         # 文字起こしワーカーを起動
         ts_worker_name = "TranscribeWorker-1"
         ts_worker_cfg = config['transcribe_worker']
-        ts_cmd_q = multiprocessing.Queue()
-        command_queues[ts_worker_name] = ts_cmd_q
+        command_queues[ts_worker_name], ts_cmd_q = create_command_channel()
+        ts_result_conn, ts_result_q = create_result_channel()
+        result_conns.append(ts_result_conn)
         ts_process = multiprocessing.Process(
-            target=transcribe_worker, args=(result_queue, ts_cmd_q, *ts_worker_cfg.values()),
+            # 以前の設定ファイルには使われなくなったキー(wait_seconds_if_no_job)も残っているので、キー名で取り出して渡す
+            target=transcribe_worker,
+            args=(ts_result_q, ts_cmd_q, ts_worker_cfg['model_size'], ts_worker_cfg['device'],
+                  ts_worker_cfg['compute_type'], ts_worker_cfg.get('cpu_threads', 0)),
             name=ts_worker_name)
         ts_process.start()
+        ts_cmd_q.close()  # 受信側はワーカーに引き渡し済み
+        ts_result_q.close()  # 送信側も同様 (閉じておくとワーカー終了をEOFで検知できる)
         workers[ts_worker_name] = ts_process
         print(f"🚀 Worker '{ts_worker_name}' started.")
 
         # メタデータ生成ワーカーを起動
         meta_worker_name = "MetaGenWorker-1"
         meta_worker_cfg = config['metagen_worker']
-        meta_cmd_q = multiprocessing.Queue()
-        command_queues[meta_worker_name] = meta_cmd_q
+        command_queues[meta_worker_name], meta_cmd_q = create_command_channel()
+        meta_result_conn, meta_result_q = create_result_channel()
+        result_conns.append(meta_result_conn)
         meta_process = multiprocessing.Process(
-            target=metagen_worker, args=(result_queue, meta_cmd_q, *meta_worker_cfg.values()),
+            target=metagen_worker,
+            args=(meta_result_q, meta_cmd_q, meta_worker_cfg['api_key'], meta_worker_cfg['model_name'],
+                  meta_worker_cfg.get('max_concurrent_jobs', 1)),
             name=meta_worker_name)
         meta_process.start()
+        meta_cmd_q.close()  # 受信側はワーカーに引き渡し済み
+        meta_result_q.close()  # 送信側も同様 (閉じておくとワーカー終了をEOFで検知できる)
         workers[meta_worker_name] = meta_process
         print(f"🚀 Worker '{meta_worker_name}' started.")
 
-        # イベントリスナーを起動
-        listener = EventListener(db_manager, result_queue, command_queues)
+        # イベントリスナーを起動 (Ctrl+Cは番兵イベントとしてリスナーに届ける)
+        listener = EventListener(db_manager, result_conns, command_queues)
+        signal.signal(signal.SIGINT, lambda *_: control_queue.put({"event": Event.SHUTDOWN}))
         listener.listen()
 
     finally:
@@ -287,16 +561,25 @@ def main():
             try:
                 print(f"👋 Sending stop command to {name}...")
                 q.put({"task": "stop"})
+                # 指令待ちでブロックしているワーカーは、stopを読み損ねてもEOFで抜けられる
+                q.close()
             except Exception as e:
                 print(f"🚨 Error sending stop command to {name}: {e}")
 
+        # 1つずつjoinせず、全ワーカーの終了を共通の締め切りまでまとめて待つ
+        running = {process.sentinel: name for name, process in workers.items()}
+        deadline = time.monotonic() + 10
+        while running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for sentinel in wait(list(running), timeout=remaining):
+                del running[sentinel]
         for name, process in workers.items():
-            if process.is_alive():
-                process.join(timeout=10)
-                if process.is_alive():
-                    print(f"😡 Worker '{name}' did not terminate, forcing it.")
-                    process.terminate()
-                    process.join()
+            if process.sentinel in running:
+                print(f"😡 Worker '{name}' did not terminate, forcing it.")
+                process.terminate()
+            process.join()
 
         print("All workers terminated.")
         if db_manager:
@@ -305,4 +588,7 @@ def main():
 
 if __name__ == '__main__':
     multiprocessing.freeze_support()
+    # GUI版と同じくspawnで起動する。forkだと親で読み込んだCTranslate2などの状態を子が引き継ぐため、
+    # GPUの初期化は各ワーカーの中で一から行わせる
+    multiprocessing.set_start_method("spawn")
     main()
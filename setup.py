@@ -1,10 +1,11 @@
 import sys
+import atexit
 import json
 import os
-import pyaudio
-import re
+import tempfile
+import threading
 from typing import Dict, Any, List, Optional
-from PySide6.QtCore import Qt, QThread, Signal, QObject
+from PySide6.QtCore import Qt, Signal, QObject, QRunnable, QThreadPool, QAbstractNativeEventFilter
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                                QHBoxLayout, QPushButton, QLabel, QComboBox, 
                                QLineEdit, QGroupBox, QTextEdit, QProgressBar,
@@ -113,81 +114,183 @@ QProgressBar::chunk {
 }
 """
 
+def _decode_cp932_mojibake(text):
+    # ASCIIだけの文字列はcp932→utf-8で変化しないので、エンコードを試さずそのまま返す
+    if text.isascii():
+        return text
+    try:
+        return text.encode("cp932").decode("utf-8")
+    except UnicodeError:
+        return text
+
 def fix_encoding(name):
     """デバイス名の文字化けを修正する関数"""
-    # 正規表現でカッコの外側と内側を分離
-    m = re.match(r"^(.*?)(\((.*?)\))?$", name)
-    if m:
-        outer = m.group(1)
-        paren = m.group(2)  # "(xxx)" もしくは None
-        inner = m.group(3)  # xxx もしくは None
-
-        # 外側のエンコーディング修正
-        try:
-            outer_fixed = outer.encode("cp932").decode("utf-8")
-        except Exception:
-            outer_fixed = outer
+    # 大半のデバイス名はASCIIなので、分割もせずにそのまま返す
+    if name.isascii():
+        return name
+    # "外側(内側)" の形なら外側と内側を別々に修正する (正規表現を使わず文字列操作だけで分割)
+    outer, paren, rest = name.partition("(")
+    if paren and rest.endswith(")"):
+        return f"{_decode_cp932_mojibake(outer)}({_decode_cp932_mojibake(rest[:-1])})"
+    return _decode_cp932_mojibake(name)
 
-        # 内側のエンコーディング修正
-        if inner is not None:
-            try:
-                inner_fixed = inner.encode("cp932").decode("utf-8")
-            except Exception:
-                inner_fixed = inner
-            paren_fixed = f"({inner_fixed})"
-        else:
-            paren_fixed = ""
+# スキャンのたびにPa_Initialize/Pa_Terminateを繰り返さないよう、PyAudioはプロセスで1つを使い回す
+# (AudioDeviceScanner._lock を持った状態でのみ触る)
+_pyaudio_instance = None
 
-        return f"{outer_fixed}{paren_fixed}"
-    else:
-        # 分離できなければ従来通り
-        try:
-            return name.encode("cp932").decode("utf-8")
-        except Exception:
-            return name
+def _get_pyaudio():
+    global _pyaudio_instance
+    if _pyaudio_instance is None:
+        # PortAudioの読み込みはスキャンするときだけにする (ウィザードを開かない起動で払わない)
+        import pyaudio
+        _pyaudio_instance = pyaudio.PyAudio()
+    return _pyaudio_instance
+
+def _reset_pyaudio():
+    """PyAudioを終了する。次の_get_pyaudio()で初期化し直され、デバイス構成の変化が反映される"""
+    global _pyaudio_instance
+    if _pyaudio_instance is not None:
+        _pyaudio_instance.terminate()
+        _pyaudio_instance = None
+
+atexit.register(_reset_pyaudio)
 
-class AudioDeviceScanner(QThread):
-    """オーディオデバイスをスキャンするワーカースレッド"""
+class AudioDeviceScannerSignals(QObject):
+    """QRunnableはシグナルを持てないので、通知用のQObjectを別に用意する"""
     devices_ready = Signal(dict)
+
+class AudioDeviceScanner(QRunnable):
+    """オーディオデバイスをスキャンするタスク (QThreadPoolで実行する)
+    結果はクラスで共有し、invalidate()されるまで同じプロセス内では列挙し直さない。"""
+    _last_devices: Optional[dict] = None
+    _lock = threading.Lock()
+
+    def __init__(self, force_rescan=False):
+        super().__init__()
+        # シグナルの受け側(GUIスレッド)で作っておくと、通知はキュー経由でGUIスレッドに届く
+        self.signals = AudioDeviceScannerSignals()
+        self.devices_ready = self.signals.devices_ready
+        # Trueならキャッシュを無視して必ず列挙し直す
+        self.force_rescan = force_rescan
     
+    @classmethod
+    def invalidate(cls):
+        """デバイス構成が変わったときに呼ぶ。次回のスキャンで列挙し直す"""
+        with cls._lock:
+            cls._last_devices = None
+            _reset_pyaudio()
+
     def run(self):
+        # 同時に走ったスキャンが二重に列挙しないよう、結果の確定までロックを持つ
+        with AudioDeviceScanner._lock:
+            if AudioDeviceScanner._last_devices is not None and not self.force_rescan:
+                self.devices_ready.emit(AudioDeviceScanner._last_devices)
+                return
+            devices = self.scan()
+            if 'error' not in devices:
+                AudioDeviceScanner._last_devices = devices
+        self.devices_ready.emit(devices)
+
+    def scan(self):
         try:
-            p = pyaudio.PyAudio()
+            if self.force_rescan:
+                # PortAudioは初期化時点のデバイスしか見えないので、明示的な再スキャンでは初期化し直す
+                _reset_pyaudio()
+            p = _get_pyaudio()
+            # PortAudioのデバイス番号は再起動やUSB機器の差し替えで変わるので、一覧はディスクに保存せず毎回列挙する
             devices = {
                 'input': []
             }
             
-            for i in range(p.get_device_count()):
-                device_info = p.get_device_info_by_index(i)
-                if int(device_info['maxInputChannels']) > 0:
-                    devices['input'].append({
-                        'index': i,
-                        'name': fix_encoding(device_info['name']),
-                        'channels': int(device_info['maxInputChannels'])
-                    })
-            
-            p.terminate()
-            self.devices_ready.emit(devices)
+            # 同じ物理デバイスがホストAPIごと(MME/DirectSound/WASAPI...)に重複して見えるので、
+            # 既定のホストAPIのデバイスだけを列挙する。録音は固定のサンプルレートで開くため、
+            # レート変換をしてくれる既定のAPI(WindowsではMME)を使う
+            host_api = p.get_default_host_api_info()
+            seen_names = set()
+            for j in range(host_api['deviceCount']):
+                device_info = p.get_device_info_by_host_api_device_index(host_api['index'], j)
+                if int(device_info['maxInputChannels']) <= 0:
+                    continue
+                name = fix_encoding(device_info['name'])
+                normalized = name.strip().lower()
+                if normalized in seen_names:
+                    continue
+                seen_names.add(normalized)
+                devices['input'].append({
+                    'index': int(device_info['index']),
+                    'name': name,
+                    'channels': int(device_info['maxInputChannels'])
+                })
+            return devices
         except Exception as e:
-            self.devices_ready.emit({'error': str(e)})
+            return {'error': str(e)}
+
+class DeviceChangeFilter(QAbstractNativeEventFilter):
+    """WindowsのWM_DEVICECHANGEを受けたらデバイス一覧のキャッシュを無効化する"""
+    WM_DEVICECHANGE = 0x0219
+
+    def nativeEventFilter(self, eventType, message):
+        if eventType == b"windows_generic_MSG":
+            from ctypes import wintypes
+            msg = wintypes.MSG.from_address(int(message))
+            if msg.message == self.WM_DEVICECHANGE:
+                AudioDeviceScanner.invalidate()
+        return False, 0
+
+_device_change_filter = None
 
-try:
-    from google import genai
-except ImportError:
-    genai = None
+def install_device_change_filter():
+    """プロセスにつき1回だけDeviceChangeFilterをアプリに登録する (Windowsのみ)"""
+    global _device_change_filter
+    if sys.platform != 'win32' or _device_change_filter is not None:
+        return
+    _device_change_filter = DeviceChangeFilter()
+    QApplication.instance().installNativeEventFilter(_device_change_filter)
+
+class ModelListFetcherSignals(QObject):
+    models_ready = Signal(str, object)
+
+class ModelListFetcher(QRunnable):
+    """APIキーで利用できるGeminiモデル名の一覧を取得するタスク (QThreadPoolで実行する)"""
+    def __init__(self, api_key):
+        super().__init__()
+        self.signals = ModelListFetcherSignals()
+        self.api_key = api_key
+
+    def run(self):
+        # Googleのクライアント一式は重いので、APIキーが入力されて初めて読み込む
+        try:
+            from google import genai
+        except ImportError:
+            return
+        try:
+            client = genai.Client(api_key=self.api_key)
+            models = [m.name for m in client.models.list() if m.name is not None]
+        except Exception:
+            models = None
+        self.signals.models_ready.emit(self.api_key, models)
 
 class SetupWizard(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("VRChatVoiceJournal - 初回セットアップ")
         self.setGeometry(100, 100, 800, 600)
-        self.setStyleSheet(MODERN_STYLESHEET)
+        # アプリ全体に同じスタイルシートが適用済みなら、ウィジェットごとに再パースさせない
+        if QApplication.instance().styleSheet() != MODERN_STYLESHEET:
+            self.setStyleSheet(MODERN_STYLESHEET)
         
         self.current_step = 0
         self.config = {}
         self.audio_devices = {}
+        # 全入力デバイス名を小文字にして改行で連結したもの (VirtualCableの有無を部分一致で調べる用)
+        self._device_names_lower = ""
+        # 最後にモデル一覧を問い合わせたAPIキーと、キーごとの取得結果
+        self._last_api_key = None
+        self._model_list_cache = {}
         
         self.init_ui()
+        # デバイスの抜き差しでキャッシュ済みの一覧が古くならないようにする
+        install_device_change_filter()
         self.scan_audio_devices()
     
     def init_ui(self):
@@ -211,10 +314,15 @@ class SetupWizard(QMainWindow):
         main_layout.addWidget(self.stacked_widget)
         
         # 各ステップのウィジェットを作成
-        self.create_step1_widget()  # VirtualCable確認
-        self.create_step2_widget()  # 録音設定
-        self.create_step3_widget()  # 文字起こし設定
-        self.create_step4_widget()  # メタデータ生成設定
+        # 最初に表示するステップ1だけを作り、残りは初めて表示するときに作る (ensure_steps)
+        self.step_builders = [
+            self.create_step1_widget,  # VirtualCable確認
+            self.create_step2_widget,  # 録音設定
+            self.create_step3_widget,  # 文字起こし設定
+            self.create_step4_widget,  # メタデータ生成設定
+        ]
+        self.built_steps = 0
+        self.ensure_steps(0)
         
         # ナビゲーションボタン
         button_layout = QHBoxLayout()
@@ -236,6 +344,13 @@ class SetupWizard(QMainWindow):
         # 初期状態設定
         self.update_navigation_buttons()
     
+    def ensure_steps(self, last_step):
+        """last_stepまでのステップのウィジェットを、まだ作っていなければ順番に作る"""
+        # QStackedWidgetの添字とステップ番号を一致させるため、必ず前のステップから作る
+        while self.built_steps <= last_step:
+            self.step_builders[self.built_steps]()
+            self.built_steps += 1
+
     def create_step1_widget(self):
         """ステップ1: VirtualCable確認"""
         widget = QWidget()
@@ -261,6 +376,11 @@ class SetupWizard(QMainWindow):
         self.install_button.setVisible(False)
         group_layout.addWidget(self.install_button)
         
+        # 再スキャンボタン (キャッシュを使わずにデバイスを列挙し直す)
+        self.rescan_button = QPushButton("デバイスを再スキャン")
+        self.rescan_button.clicked.connect(lambda: self.scan_audio_devices(force_rescan=True))
+        group_layout.addWidget(self.rescan_button)
+        
         group.setLayout(group_layout)
         layout.addWidget(group)
         layout.addStretch()
@@ -315,6 +435,8 @@ class SetupWizard(QMainWindow):
         layout.addWidget(self.detail_record_widget)
         layout.addStretch()
         self.stacked_widget.addWidget(widget)
+        # スキャンがこのステップを開く前に終わっていた場合に備えて、ここでも一覧を入れる
+        self.populate_device_combos()
 
     def create_step3_widget(self):
         """ステップ3: 文字起こし設定"""
@@ -350,12 +472,9 @@ class SetupWizard(QMainWindow):
         self.compute_type_combo.addItems(["int8", "float16", "float32"])
         self.compute_type_combo.setCurrentText("int8")
         detail_transcribe_layout.addWidget(self.compute_type_combo)
-        # 待機時間
-        detail_transcribe_layout.addWidget(QLabel("待機時間 (秒):"))
-        self.transcribe_wait_spin = QSpinBox()
-        self.transcribe_wait_spin.setRange(10, 120)
-        self.transcribe_wait_spin.setValue(30)
-        detail_transcribe_layout.addWidget(self.transcribe_wait_spin)
+        # GPUではfloat16、CPUではint8が速いので、デバイスに合わせて計算タイプの既定を切り替える
+        self.device_combo.currentTextChanged.connect(
+            lambda device: self.compute_type_combo.setCurrentText("float16" if device == "cuda" else "int8"))
         self.detail_transcribe_widget.setVisible(False)
         group_layout.addWidget(self.detail_transcribe_widget)
         
@@ -400,23 +519,6 @@ class SetupWizard(QMainWindow):
         self.model_name_combo.setCurrentText("gemini-2.5-flash")
         group_layout.addWidget(self.model_name_combo)
         
-        # 詳細設定（折りたたみ）
-        self.detail_meta_checkbox = QCheckBox("詳細設定を表示")
-        self.detail_meta_checkbox.setChecked(False)
-        self.detail_meta_checkbox.toggled.connect(lambda checked: self.detail_meta_widget.setVisible(checked))
-        group_layout.addWidget(self.detail_meta_checkbox)
-        
-        self.detail_meta_widget = QWidget()
-        detail_meta_layout = QVBoxLayout(self.detail_meta_widget)
-        # 待機時間
-        detail_meta_layout.addWidget(QLabel("待機時間 (秒):"))
-        self.meta_wait_spin = QSpinBox()
-        self.meta_wait_spin.setRange(30, 300)
-        self.meta_wait_spin.setValue(60)
-        detail_meta_layout.addWidget(self.meta_wait_spin)
-        self.detail_meta_widget.setVisible(False)
-        group_layout.addWidget(self.detail_meta_widget)
-        
         group.setLayout(group_layout)
         layout.addWidget(group)
         layout.addStretch()
@@ -431,33 +533,30 @@ class SetupWizard(QMainWindow):
                "公式ドキュメント: https://ai.google.dev/gemini-api/docs/get-started")
         QMessageBox.information(self, "Gemini APIキーの取得方法", msg)
 
-    def scan_audio_devices(self):
+    def scan_audio_devices(self, force_rescan=False):
         """オーディオデバイスをスキャン"""
-        self.scanner = AudioDeviceScanner()
-        self.scanner.devices_ready.connect(self.on_devices_ready)
-        self.scanner.start()
+        # スキャンを重ねて走らせないよう、完了まで再スキャンを止める
+        self.rescan_button.setEnabled(False)
+        scanner = AudioDeviceScanner(force_rescan=force_rescan)
+        scanner.devices_ready.connect(self.on_devices_ready)
+        QThreadPool.globalInstance().start(scanner)
     
     def open_vc_install_page(self):
         """VirtualCableのインストールページを開く"""
         import webbrowser
         webbrowser.open("https://vb-audio.com/Cable/")
 
-    def check_virtualcable_installed(self, devices):
+    def check_virtualcable_installed(self):
         """VirtualCableがインストールされているかチェック"""
-        cable_input_found = False
-        cable_output_found = False
-        
-        for device in devices['input']:
-            device_name = device['name'].lower()
-            if 'cable input' in device_name or 'vb-audio virtual cable' in device_name:
-                cable_input_found = True
-            if 'cable output' in device_name or 'vb-audio virtual cable' in device_name:
-                cable_output_found = True
-        
+        # デバイス名は on_devices_ready で小文字化して1つの文字列にまとめてある
+        names = self._device_names_lower
+        cable_input_found = 'cable input' in names or 'vb-audio virtual cable' in names
+        cable_output_found = 'cable output' in names or 'vb-audio virtual cable' in names
         return cable_input_found and cable_output_found
 
     def on_devices_ready(self, devices):
         """オーディオデバイスのスキャン完了"""
+        self.rescan_button.setEnabled(True)
         if 'error' in devices:
             self.vc_status_label.setText("❌ エラーが発生しました")
             self.vc_status_label.setStyleSheet("font-weight: bold; color: #e74c3c;")
@@ -465,13 +564,15 @@ class SetupWizard(QMainWindow):
             return
         
         self.audio_devices = devices
+        self._device_names_lower = "\n".join(device['name'].lower() for device in devices['input'])
         
         # VirtualCableの確認
-        vc_installed = self.check_virtualcable_installed(devices)
+        vc_installed = self.check_virtualcable_installed()
         
         if vc_installed:
             self.vc_status_label.setText("✅ VirtualCableがインストールされています")
             self.vc_status_label.setStyleSheet("font-weight: bold; color: #27ae60;")
+            self.install_button.setVisible(False)
             
             info_text = """✅ VirtualCableが正常にインストールされています！
 
@@ -498,11 +599,17 @@ class SetupWizard(QMainWindow):
         
         self.vc_info_text.setText(info_text)
         
+        # ステップ2をまだ作っていなければ、作るときに入れる
+        if self.built_steps > 1:
+            self.populate_device_combos()
+
+    def populate_device_combos(self):
+        """スキャン済みのデバイスをステップ2のコンボボックスに入れる"""
         # コンボボックスにデバイス名のみを追加
         self.record_device_combo.clear()
         self.mic_device_combo.clear()
         
-        for device in devices['input']:
+        for device in self.audio_devices.get('input', []):
             self.record_device_combo.addItem(device['name'], device['index'])
             self.mic_device_combo.addItem(device['name'], device['index'])
         
@@ -532,6 +639,7 @@ class SetupWizard(QMainWindow):
             "ステップ 4/4: メタデータ生成設定"
         ]
         
+        self.ensure_steps(self.current_step)
         self.step_label.setText(step_names[self.current_step])
         self.progress_bar.setValue(self.current_step + 1)
         self.stacked_widget.setCurrentIndex(self.current_step)
@@ -555,7 +663,7 @@ class SetupWizard(QMainWindow):
             # VirtualCableがインストールされているかチェック
             if len(self.audio_devices.get('input', [])) == 0:
                 return False
-            return self.check_virtualcable_installed(self.audio_devices)
+            return self.check_virtualcable_installed()
         elif self.current_step == 1:
             return (self.record_device_combo.currentData() is not None and 
                    self.mic_device_combo.currentData() is not None)
@@ -567,6 +675,8 @@ class SetupWizard(QMainWindow):
     
     def collect_config(self):
         """設定を収集"""
+        # 開いていないステップの既定値も読むので、全ステップを作っておく
+        self.ensure_steps(len(self.step_builders) - 1)
         config = {
             "db_path": "./data/db.sqlite3",
             "base_dir": "./",
@@ -585,12 +695,14 @@ class SetupWizard(QMainWindow):
                 "model_size": self.model_size_combo.currentText(),
                 "device": self.device_combo.currentText(),
                 "compute_type": self.compute_type_combo.currentText(),
-                "wait_seconds_if_no_job": self.transcribe_wait_spin.value()
+                # CPU推論のスレッド数 (0ならfaster-whisperの既定の4スレッド。VRChatと同じPCで動かすので全コアは割り当てない)
+                "cpu_threads": 0
             },
             "metagen_worker": {
                 "api_key": self.api_key_edit.text().strip(),
                 "model_name": self.model_name_combo.currentText(),
-                "wait_seconds_if_no_job": self.meta_wait_spin.value()
+                # Geminiへ同時に投げるジョブ数 (無料枠のレート制限に当たらないよう既定は1)
+                "max_concurrent_jobs": 1
             }
         }
         return config
@@ -604,9 +716,16 @@ class SetupWizard(QMainWindow):
         try:
             config = self.collect_config()
             
-            # config.jsonを保存
-            with open('config.json', 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=4, ensure_ascii=False)
+            # config.jsonを保存 (同じディレクトリの一時ファイルに書いてから置き換え、書きかけのファイルを残さない)
+            f = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir='.', prefix='config.', suffix='.tmp', delete=False)
+            try:
+                with f:
+                    json.dump(config, f, indent=4, ensure_ascii=False)
+                os.replace(f.name, 'config.json')
+            except BaseException:
+                # 書き込みや置き換えに失敗したら一時ファイルを残さない
+                os.unlink(f.name)
+                raise
             
             # dataディレクトリを作成
             os.makedirs('./data', exist_ok=True)
@@ -621,23 +740,39 @@ class SetupWizard(QMainWindow):
 
     def update_model_list_from_api(self):
         api_key = self.api_key_edit.text().strip()
-        if not api_key or genai is None:
+        # editingFinishedはフォーカスが外れるたびに来るので、キーが変わっていなければ問い合わせない
+        if not api_key or api_key == self._last_api_key:
+            return
+        self._last_api_key = api_key
+        if api_key in self._model_list_cache:
+            self.on_models_ready(api_key, self._model_list_cache[api_key])
+            return
+        # 通信でUIを止めないよう、モデル一覧の取得はスレッドプールで行う
+        fetcher = ModelListFetcher(api_key)
+        fetcher.signals.models_ready.connect(self.on_models_ready)
+        QThreadPool.globalInstance().start(fetcher)
+
+    def on_models_ready(self, api_key, models):
+        """モデル一覧の取得完了 (modelsがNoneなら取得失敗)"""
+        # 取得中にキーが変更された場合、古いキーの結果は捨てる
+        if api_key != self._last_api_key:
             return
         self.model_name_combo.clear()
-        try:
-            client = genai.Client(api_key=api_key)
-            models = [m.name for m in client.models.list() if m.name is not None]
-            if not models:
-                self.model_name_combo.addItem("利用可能なモデルがありません")
-            else:
-                self.model_name_combo.addItems(models)
-                # 2.5-flashがあれば初期選択
-                for i, name in enumerate(models):
-                    if "2.5-flash" in name:
-                        self.model_name_combo.setCurrentIndex(i)
-                        break
-        except Exception as e:
+        if models is None:
             self.model_name_combo.addItem("モデル取得失敗")
+            # 失敗したキーは次のeditingFinishedで再試行できるようにしておく
+            self._last_api_key = None
+            return
+        self._model_list_cache[api_key] = models
+        if not models:
+            self.model_name_combo.addItem("利用可能なモデルがありません")
+        else:
+            self.model_name_combo.addItems(models)
+            # 2.5-flashがあれば初期選択
+            for i, name in enumerate(models):
+                if "2.5-flash" in name:
+                    self.model_name_combo.setCurrentIndex(i)
+                    break
 
 def run_setup_wizard(app=None):
     if app is None:
@@ -666,6 +801,8 @@ def main():
         if reply == QMessageBox.StandardButton.No:
             return
     
+    # 単体で起動したときはウィザードしか表示しないので、スタイルシートはアプリに1回だけ適用する
+    app.setStyleSheet(MODERN_STYLESHEET)
     window = SetupWizard()
     window.show()
     sys.exit(app.exec())
@@ -1,5 +1,7 @@
+from .command_channel import *
+from .events import *
 from .metagen_worker import *
 from .record_worker import *
 from .transcribe_worker import *
 
-__all__ = ["metagen_worker", "record_worker", "transcribe_worker"]
\ No newline at end of file
+__all__ = ["command_channel", "events", "metagen_worker", "record_worker", "transcribe_worker"]
\ No newline at end of file
@@ -0,0 +1,57 @@
+import multiprocessing
+import threading
+from multiprocessing.connection import Connection
+from typing import Tuple
+
+class CommandChannel:
+    """
+    単方向Pipeの送信側をQueueと同じput()で使えるようにしたチャネル。
+    送り手も受け手も1つずつなので、Queueではなく単方向Pipeで送る(フィーダースレッドを持たない)。
+    メインプロセス -> ワーカーの指令と、ワーカー -> メインプロセスの結果通知の両方に使う。
+    同じプロセス内の複数スレッドから送られることがあるため、送信はロックで直列化する。
+    """
+    def __init__(self, conn: Connection):
+        self._conn = conn
+        self._lock = threading.Lock()
+
+    def put(self, command: dict):
+        with self._lock:
+            try:
+                self._conn.send(command)
+            except (BrokenPipeError, EOFError, OSError):
+                # 相手側が既に終了している場合はQueueと同様に黙って捨てる
+                pass
+
+    def put_many(self, commands: list):
+        """複数のメッセージを1回のsendでまとめて送る。受け手はrecv_into()で展開する。"""
+        if not commands:
+            return
+        self.put(commands)
+
+    def close(self):
+        self._conn.close()
+
+    # ワーカーへ引数として渡せるよう、ロックは渡した先で作り直す
+    def __getstate__(self):
+        return self._conn
+
+    def __setstate__(self, conn: Connection):
+        self.__init__(conn)
+
+def recv_into(conn: Connection, batch: list):
+    """connから1回受信してbatchに積む。put_many()でまとめて送られたものは1件ずつに展開する。"""
+    message = conn.recv()
+    if isinstance(message, list):
+        batch.extend(message)
+    else:
+        batch.append(message)
+
+def create_command_channel(ctx=multiprocessing) -> Tuple[CommandChannel, Connection]:
+    """(メインプロセス側の送信チャネル, ワーカーに渡す受信側Connection) を作る。"""
+    receiver, sender = ctx.Pipe(duplex=False)
+    return CommandChannel(sender), receiver
+
+def create_result_channel(ctx=multiprocessing) -> Tuple[Connection, CommandChannel]:
+    """(メインプロセス側の受信Connection, ワーカーに渡す送信チャネル) を作る。"""
+    receiver, sender = ctx.Pipe(duplex=False)
+    return receiver, CommandChannel(sender)
@@ -0,0 +1,23 @@
+from enum import IntEnum
+
+class Event(IntEnum):
+    """
+    result_queue に流すイベントの種別。
+    メインプロセスはこの値をそのまま添字にしてハンドラ表を引くので、0からの連番を崩さないこと。
+    """
+    RECORD_STARTED = 0
+    RECORD_DONE = 1
+    RECORD_PAUSED = 2
+    RECORD_RESUMED = 3
+    RECORD_IDLE = 4
+    TRANSCRIBE_STARTED = 5
+    TRANSCRIBE_DONE = 6
+    TRANSCRIBE_IDLE = 7
+    META_STARTED = 8
+    META_DONE = 9
+    META_IDLE = 10
+    ERROR = 11
+    REQUEST_TRANSCRIBE_JOB = 12
+    REQUEST_METAGEN_JOB = 13
+    TOGGLE_AI_PAUSE = 14  # GUIからリスナーへの通知
+    SHUTDOWN = 15  # リスナーループを終了させるための番兵
@@ -1,9 +1,18 @@
-import multiprocessing
+from multiprocessing.connection import Connection
+from .command_channel import CommandChannel
+from .events import Event
 import time
+from concurrent.futures import ThreadPoolExecutor
+import json
 from google import genai
 from typing import List
 from pydantic import BaseModel
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # 注意！ライブラリのインストールコマンドが変わりました！
 # pip install google-genai
 
@@ -14,12 +23,8 @@ class MetaResponse(BaseModel):
     markers: List[Markers]
     tags: List[str]
 
-def generate_prompt(transcript_text: str) -> str:
-    """
-    Geminiに投げるためのプロンプトを生成する。
-    test_metagen.pyを参考に、JSONモードでの出力に適した指示に修正。
-    """
-    prompt = f"""
+# プロンプトの固定部分 (文字起こしデータの前後) は毎回組み立てずに使い回す
+_PROMPT_HEADER = """
 あなたは、会話の文字起こしデータを分析し、構造化されたメタデータを抽出する専門家です。
 Aiを使用した文字起こしデータのため、ミスが含まれる場合があります。
 マーカーはその時の話題をできるだけ言い換えずに一言でまとめてください。
@@ -29,9 +34,15 @@ Aiを使用した文字起こしデータのため、ミスが含まれる場合
 以下の【文字起こしデータ】を分析し、スキーマのとおりに会話のマーカーとタグを数個抽出してください。
 
 【文字起こしデータ】
-{transcript_text}
 """
-    return prompt
+_PROMPT_TAIL = "\n"
+
+def generate_prompt(transcript_text: str) -> str:
+    """
+    Geminiに投げるためのプロンプトを生成する。
+    test_metagen.pyを参考に、JSONモードでの出力に適した指示に修正。
+    """
+    return _PROMPT_HEADER + transcript_text + _PROMPT_TAIL
 
 def format_transcript(segments: list) -> str:
     """
@@ -45,13 +56,14 @@ def format_transcript(segments: list) -> str:
         lines.append(f"[{start:.2f}s -> {end:.2f}s] {text}")
     return "\n".join(lines)
 
-def metagen_worker(result_queue: multiprocessing.Queue,
-                     command_queue: multiprocessing.Queue,
+def metagen_worker(result_queue: CommandChannel,
+                     command_queue: Connection,
                      api_key: str,
                      model_name: str,
-                     wait_seconds: int):
+                     max_concurrent_jobs: int = 1):
     """
     メタデータ（マーカーとタグ）を生成するワーカープロセス。
+    Geminiの応答待ちは通信待ちなので、最大max_concurrent_jobs件のジョブを並行して処理する。
     """
     print(f"Metagen worker started. Model: {model_name}")
 
@@ -61,59 +73,83 @@ def metagen_worker(result_queue: multiprocessing.Queue,
 
     except Exception as e:
         print(f"[FATAL] Failed to configure Gemini model: {e}")
-        result_queue.put({"event": "error", "worker": worker_name, "payload": {"error_message": f"Geminiの設定に失敗: {e}"}})
+        result_queue.put({"event": Event.ERROR, "worker": worker_name, "payload": {"error_message": f"Geminiの設定に失敗: {e}"}})
         return
 
-    while True:
-        try:
-            result_queue.put({"event": "request_metagen_job", "worker": worker_name, "payload": {}})
-
-            command: dict = command_queue.get()
-            task = command.get("task")
-            payload = command.get("payload", {})
-
-            if task == "generate_meta":
-                session_id = payload['session_id']
-                segments = payload['segments_json']
-                result_queue.put({"event": "meta_started", "worker": worker_name, "payload": {"session_id": session_id}})
-                transcript_text = format_transcript(segments)
-                prompt = generate_prompt(transcript_text)
-
-                response = client.models.generate_content(
-                    model=model_name,
-                    contents=prompt,
-                    config={
-                        "response_mime_type": "application/json",
-                        "response_schema": MetaResponse
-                    }
-                )
-
-                meta_data: MetaResponse = response.parsed # type: ignore
-
-                result_queue.put({
-                    "event": "meta_done",
-                    "worker": worker_name,
-                    "payload": {
-                        "session_id": session_id,
-                        "markers": [marker.model_dump() for marker in meta_data.markers], # Pydanticモデルを辞書に変換
-                        "tags": meta_data.tags
-                    }
-                })
-                result_queue.put({"event": "meta_idle", "worker": worker_name, "payload": {}})
-
-            elif task == "standby":
-                result_queue.put({"event": "meta_idle", "worker": worker_name, "payload": {}})
-                print(f"No job for metadata. Standing by for {wait_seconds} seconds...")
-                time.sleep(wait_seconds)
-
-            elif task == "stop":
-                result_queue.put({"event": "meta_idle", "worker": worker_name, "payload": {}})
-                print("Stop command received. Exiting worker.")
-                break
-            else:
-                result_queue.put({"event": "meta_idle", "worker": worker_name, "payload": {}})
+    request_event = {"event": Event.REQUEST_METAGEN_JOB, "worker": worker_name, "payload": {}}
+    idle_event = {"event": Event.META_IDLE, "worker": worker_name, "payload": {}}
 
+    def run_job(payload: dict):
+        """1件のジョブを処理し、完了通知と次のジョブ要求を1回の送信でまとめて返す (スレッドプール上で実行)"""
+        session_id = payload.get('session_id')
+        events = []
+        try:
+            segments = payload['segments_json']
+            # メインプロセスからはDBのJSON文字列がそのまま届く
+            if isinstance(segments, str):
+                try:
+                    segments = orjson.loads(segments) if orjson is not None else json.loads(segments)
+                except ValueError as e:
+                    events.append({"event": Event.ERROR, "worker": worker_name, "payload": {"session_id": session_id, "error_message": f"segments_jsonのデコードに失敗: {e}"}})
+                    events.append(idle_event)
+                    return
+            result_queue.put({"event": Event.META_STARTED, "worker": worker_name, "payload": {"session_id": session_id}})
+            transcript_text = format_transcript(segments)
+            prompt = generate_prompt(transcript_text)
+
+            response = client.models.generate_content(
+                model=model_name,
+                contents=prompt,
+                config={
+                    "response_mime_type": "application/json",
+                    "response_schema": MetaResponse
+                }
+            )
+
+            meta_data: MetaResponse = response.parsed # type: ignore
+
+            events.append({
+                "event": Event.META_DONE,
+                "worker": worker_name,
+                "payload": {
+                    "session_id": session_id,
+                    # (time, content)のタプルで送る。辞書よりpickleが小さく、親はそのままDBの行にできる
+                    "markers": [(marker.time, marker.content) for marker in meta_data.markers],
+                    "tags": meta_data.tags
+                }
+            })
+            events.append(idle_event)
         except Exception as e:
             print(f"[ERROR] An unexpected error occurred in metagen_worker: {e}")
-            result_queue.put({"event": "error", "worker": worker_name, "payload": {"error_message": str(e)}})
-            time.sleep(10)
\ No newline at end of file
+            # 通信エラーなど一時的な失敗もあるので、セッションはERRORにせず(retry)割り当てだけ解いてもらう
+            result_queue.put({"event": Event.ERROR, "worker": worker_name, "payload": {"session_id": session_id, "error_message": str(e), "retry": True}})
+            time.sleep(10)
+        finally:
+            events.append(request_event)
+            result_queue.put_many(events)
+
+    # ジョブの完了を待つのはプールのスレッドで、このスレッドは指令の受信だけを行う。
+    # withを抜けるときに処理中のジョブの完了を待つ
+    with ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix="MetaGenJob") as executor:
+        # 並行数の分だけ先にジョブを要求しておく。以降は各ジョブの完了時に1件ずつ要求する
+        result_queue.put_many([request_event] * max_concurrent_jobs)
+        while True:
+            try:
+                command: dict = command_queue.recv()
+                task = command.get("task")
+                payload = command.get("payload", {})
+
+                if task == "generate_meta":
+                    executor.submit(run_job, payload)
+
+                elif task == "stop":
+                    result_queue.put(idle_event)
+                    print("Stop command received. Exiting worker.")
+                    break
+                else:
+                    result_queue.put_many([idle_event, request_event])
+
+            except EOFError:
+                # メインプロセス側の送信チャネルが閉じられた
+                print("Command channel closed. Exiting worker.")
+                break
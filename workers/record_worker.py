@@ -1,15 +1,132 @@
 import pyaudio
 import wave
-import queue
 import numpy as np
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
-import multiprocessing
+from multiprocessing.connection import Connection
+from .command_channel import CommandChannel
+from .events import Event
 import uuid
+import re
+import os
+import sys
+import threading
 from pathlib import Path
 
-def record_worker(result_queue: multiprocessing.Queue,
-                  command_queue: multiprocessing.Queue,
+class _AudioRing:
+    """
+    PortAudioのコールバックから受け取ったint16サンプルを溜めるリングバッファ。
+    書き手はコールバックスレッド、読み手はワーカーのループの1対1なので、読み書き位置は各自が更新するだけでロックは使わない。
+    容量は2のべき乗にしてインデックスをマスクで折り返す。溢れた分は exception_on_overflow=False と同じく捨てる。
+    溢れたときもフレーム (全チャンネル分のサンプル) 単位で書き込み、読み出し側のチャンネルの並びがずれないようにする。
+    """
+    def __init__(self, samples: int, channels: int):
+        capacity = 1 << max(samples - 1, 1).bit_length()
+        self._buf = np.zeros(capacity, dtype=np.int16)
+        self._capacity = capacity
+        self._mask = capacity - 1
+        self._channels = channels
+        self._write = 0
+        self._read = 0
+        self._ready = threading.Event()
+
+    def callback(self, in_data, frame_count, time_info, status):
+        data = np.frombuffer(in_data, dtype=np.int16)
+        w = self._write
+        n = min(len(data), self._capacity - (w - self._read))
+        n -= n % self._channels
+        if n > 0:
+            i = w & self._mask
+            first = min(n, self._capacity - i)
+            self._buf[i:i + first] = data[:first]
+            self._buf[:n - first] = data[first:n]
+            self._write = w + n
+        self._ready.set()
+        return (None, pyaudio.paContinue)
+
+    def read_into(self, out: np.ndarray, stream) -> np.ndarray:
+        """outが埋まるまで待ってから読み出す。ストリームが止まっている場合はIOErrorを送出する。"""
+        n = len(out)
+        while self._write - self._read < n:
+            self._ready.clear()
+            if self._write - self._read >= n:
+                break
+            if not self._ready.wait(0.5) and not stream.is_active():
+                raise IOError("録音ストリームが停止しました。")
+        r = self._read
+        i = r & self._mask
+        first = min(n, self._capacity - i)
+        out[:first] = self._buf[i:i + first]
+        out[first:] = self._buf[:n - first]
+        self._read = r + n
+        return out
+
+    def discard(self):
+        """溜まっているサンプルを捨てる (一時停止から再開したときに古い音声を書かないように)。"""
+        self._read = self._write
+
+def _raise_priority():
+    """
+    録音プロセスの優先度を上げ、CPU負荷が高いときに取り込みが遅れて音が欠けるのを防ぐ。
+    特定のコアへの固定は他の処理と取り合いになるため行わない。上げられない環境ではそのまま続行する。
+    """
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            ABOVE_NORMAL_PRIORITY_CLASS = 0x00008000
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), ABOVE_NORMAL_PRIORITY_CLASS)
+        else:
+            # 優先度を上げるには権限が必要なことが多い
+            os.nice(-5)
+    except (OSError, AttributeError) as e:
+        print(f"[RecordWorker] Could not raise process priority: {e}")
+
+def _make_mixer(mic_in: np.ndarray, mic_channels: int, vc_in: np.ndarray, vc_channels: int,
+                monoral_mic: bool, chunk_out: np.ndarray):
+    """
+    mic_in / vc_in の1チャンクを混合して chunk_out (int16, (CHUNK, 2)) に書き込む関数を作る。
+    チャンネル数とモノラル化の有無は録音中に変わらないので、チャンネルの切り出しや分岐はここで一度だけ決めておく。
+    """
+    frames, output_channels = chunk_out.shape
+    # (フレーム数, チャンネル数) に並べ、3チャンネル以上なら先頭の2チャンネルを使う。
+    # モノラルは (フレーム数, 1) のまま混合時のブロードキャストで両チャンネルへ広げるので、repeatでの複製は作らない
+    mic_frames = mic_in.reshape(frames, mic_channels)[:, :output_channels]
+    vc_frames = vc_in.reshape(frames, vc_channels)[:, :output_channels]
+    # 混合用のint32作業領域 (1チャンク分)。毎チャンク一時配列を作らずに使い回す
+    mixed = np.empty((frames, output_channels), dtype=np.int32)
+    np_add = np.add
+    np_clip = np.clip
+    np_multiply = np.multiply
+    np_right_shift = np.right_shift
+
+    def scale_and_clip():
+        # ゲイン0.8は固定小数点で掛ける (13107/2**14 ≒ 0.8)。浮動小数点への昇格を避け、
+        # 乗算・シフトは作業領域の中で行い(クロージャから参照するため out= で書き戻す)、クリップ結果はint16の出力バッファへ直接書き込む
+        np_multiply(mixed, 13107, out=mixed)
+        np_right_shift(mixed, 14, out=mixed)
+        np_clip(mixed, -32768, 32767, out=chunk_out, casting='unsafe')
+
+    if monoral_mic and mic_channels >= 2:
+        # monoral_mic処理: L=R=(L+R)/2 を整数の加算とシフトで求める (浮動小数点への昇格をしない)
+        mic_left = mic_frames[:, 0]
+        mic_right = mic_frames[:, 1]
+        mono = np.empty(frames, dtype=np.int32)
+        mono_column = mono[:, np.newaxis]
+
+        def mix():
+            np_add(mic_left, mic_right, out=mono, dtype=np.int32)
+            np_right_shift(mono, 1, out=mono)
+            np_add(mono_column, vc_frames, out=mixed, dtype=np.int32, casting='unsafe')
+            scale_and_clip()
+    else:
+        def mix():
+            np_add(mic_frames, vc_frames, out=mixed, dtype=np.int32, casting='unsafe')
+            scale_and_clip()
+    return mix
+
+def record_worker(result_queue: CommandChannel,
+                  command_queue: Connection,
                   base_dir: str,
                   vc_device_index: int,
                   mic_device_index: int,
@@ -25,6 +142,7 @@ def record_worker(result_queue: multiprocessing.Queue,
     CHUNK = chunk
     RECORD_SECONDS = record_seconds
 
+    _raise_priority()
     pa = pyaudio.PyAudio()
     mic_name = pa.get_device_info_by_index(mic_device_index).get('name')
     mic_channels = int(pa.get_device_info_by_index(mic_device_index).get('maxInputChannels', 1))
@@ -32,40 +150,63 @@ def record_worker(result_queue: multiprocessing.Queue,
     vc_channels = int(pa.get_device_info_by_index(vc_device_index).get('maxInputChannels', 1))
     output_channels = 2  # 出力は必ずステレオ
     print(f"[RecordWorker] Recording started. Mic: {mic_name}, VC: {vc_name}")
+    # 取り込みはPortAudioのコールバックでリングバッファへ積み、ループ側は混合と書き出しだけを行う。
+    # 混合やディスク書き込みが一時的に遅れても、約1.5秒分(64チャンク)まではデバイス側で取りこぼさない
+    mic_ring = _AudioRing(CHUNK * mic_channels * 64, mic_channels)
+    vc_ring = _AudioRing(CHUNK * vc_channels * 64, vc_channels)
     mic_stream = pa.open(format=FORMAT,
                          channels=mic_channels,
                          rate=RATE,
                          input=True,
                          frames_per_buffer=CHUNK,
-                         input_device_index=mic_device_index)
+                         input_device_index=mic_device_index,
+                         stream_callback=mic_ring.callback)
 
     vc_stream = pa.open(format=FORMAT,
                         channels=vc_channels,
                         rate=RATE,
                         input=True,
                         frames_per_buffer=CHUNK,
-                        input_device_index=vc_device_index)
+                        input_device_index=vc_device_index,
+                        stream_callback=vc_ring.callback)
     
     bytes_per_sample = pa.get_sample_size(FORMAT)
-    mute_bytes = b"\x00" * (CHUNK * output_channels * bytes_per_sample)
+    # リングバッファから1チャンク分を読み出す先。ミュート中も読み出してから無音で上書きするので、
+    # 録音のペースは常にデバイス側で決まる
+    mic_in = np.empty(CHUNK * mic_channels, dtype=np.int16)
+    vc_in = np.empty(CHUNK * vc_channels, dtype=np.int16)
+    chunks_per_session = int(RATE / CHUNK * RECORD_SECONDS)
+    # 1チャンク分のint16出力バッファ。クリップ結果をここに書き、そのままWAVへ書き出す
+    chunk_out = np.empty((CHUNK, output_channels), dtype=np.int16)
+    mix = _make_mixer(mic_in, mic_channels, vc_in, vc_channels, monoral_mic, chunk_out)
     pause = False
     recording = True
     mic_mute = False
     vc_mute = False
     worker_name = "RecordWorker-1"
+    # セッションごと・チャンクごとに変わらないものはループの外で一度だけ用意する
+    tz = ZoneInfo(timezone_str)
+    audio_dir = Path(base_dir) / "data" / "audio"
+    tz_suffix = re.compile(r"\+\d{2}:\d{2}$")
+    # 毎チャンク呼ぶメソッドはローカル変数に束縛して属性の検索を省く
+    mic_read = mic_ring.read_into
+    vc_read = vc_ring.read_into
+    cmd_poll = command_queue.poll
+    # 指令は人の操作(一時停止・ミュート)なので、8チャンク(約190ms)ごとに確認すれば十分
+    cmd_poll_mask = 7
     try:
         while recording:
             if pause:
-                result_queue.put({"event": "record_paused", "worker": worker_name, "payload": {}})
-                cmd_raw = command_queue.get()
+                result_queue.put({"event": Event.RECORD_PAUSED, "worker": worker_name, "payload": {}})
+                cmd_raw = command_queue.recv()
                 cmd = cmd_raw.get("task")
                 print(f"[RecordWorker] Received command: {cmd}")
                 if cmd == "resume":
                     pause = False
-                    result_queue.put({"event": "record_resumed", "worker": worker_name, "payload": {}})
+                    result_queue.put({"event": Event.RECORD_RESUMED, "worker": worker_name, "payload": {}})
                 elif cmd == "stop":
                     recording = False
-                    result_queue.put({"event": "record_idle", "worker": worker_name, "payload": {}})
+                    result_queue.put({"event": Event.RECORD_IDLE, "worker": worker_name, "payload": {}})
                     break
                 elif cmd == "mic_mute":
                     mic_mute = True
@@ -82,104 +223,62 @@ def record_worker(result_queue: multiprocessing.Queue,
                 else:
                     continue
 
-            buffer = []
             session_id = uuid.uuid4()
-            now = datetime.now(tz=ZoneInfo(timezone_str))
+            now = datetime.now(tz=tz)
             date = now.strftime("%Y-%m-%d")
             file_name = now.strftime("%Y-%m-%d_%H-%M-%S")
-            import re
-            timestamp = re.sub(r"\+\d{2}:\d{2}$", "Z", now.isoformat(timespec="milliseconds"))
-            base_path = Path(base_dir)
-            dir_path = base_path / "data" / "audio" / date
+            timestamp = tz_suffix.sub("Z", now.isoformat(timespec="milliseconds"))
+            dir_path = audio_dir / date
             dir_path.mkdir(parents=True, exist_ok=True)
             file_path = dir_path / f"{file_name}.wav"
-            result_queue.put({"event": "record_started", "worker": worker_name, "payload": {"session_id": str(session_id)}})
-            for _ in range(int(RATE / CHUNK * RECORD_SECONDS)):
-                mic_data = mic_stream.read(CHUNK, exception_on_overflow=False) if not mic_mute else mute_bytes
-                vc_data = vc_stream.read(CHUNK, exception_on_overflow=False) if not vc_mute else mute_bytes
-                
-                mic_np = np.frombuffer(mic_data, dtype=np.int16).astype(np.int32)
-                vc_np = np.frombuffer(vc_data, dtype=np.int16).astype(np.int32)
-
-                # 各チャンネルのサンプル数を計算
-                mic_samples_per_channel = len(mic_np) // mic_channels
-                vc_samples_per_channel = len(vc_np) // vc_channels
-                
-                # 最小のサンプル数に合わせる
-                min_samples = min(mic_samples_per_channel, vc_samples_per_channel)
-                
-                # データを適切な形状にリシェイプ
-                if mic_channels == 1:
-                    mic_np = mic_np[:min_samples]
-                    mic_np = np.repeat(mic_np, 2)
-                else:
-                    mic_np = mic_np[:min_samples * mic_channels].reshape(-1, mic_channels)
-                    if mic_channels == 1:
-                        mic_np = np.repeat(mic_np, 2, axis=1)
-                    elif mic_channels > 2:
-                        # 2チャンネル以上の場合、最初の2チャンネルを使用
-                        mic_np = mic_np[:, :2]
-                
-                if vc_channels == 1:
-                    vc_np = vc_np[:min_samples]
-                    vc_np = np.repeat(vc_np, 2)
-                else:
-                    vc_np = vc_np[:min_samples * vc_channels].reshape(-1, vc_channels)
-                    if vc_channels == 1:
-                        vc_np = np.repeat(vc_np, 2, axis=1)
-                    elif vc_channels > 2:
-                        # 2チャンネル以上の場合、最初の2チャンネルを使用
-                        vc_np = vc_np[:, :2]
-
-                # monoral_mic処理
-                if monoral_mic:
-                    mic_mono = mic_np.mean(axis=1)
-                    mic_np = np.repeat(mic_mono[:, np.newaxis], 2, axis=1)
-                
-                # 最終的な形状を確認してから混合
-                if mic_np.shape != vc_np.shape:
-                    # 形状が一致しない場合、小さい方に合わせる
-                    min_rows = min(mic_np.shape[0], vc_np.shape[0])
-                    mic_np = mic_np[:min_rows]
-                    vc_np = vc_np[:min_rows]
-                
-                gain = 0.8
-                mixed = (mic_np + vc_np) * gain
-                mixed = np.clip(mixed, -32768, 32767).astype(np.int16)
-                buffer.append(mixed.tobytes())
-
-                try:
-                    cmd_raw = command_queue.get_nowait()
-                    cmd = cmd_raw.get("task")
-                    print(f"[RecordWorker] Received command: {cmd}")
-                    if cmd == "pause":
-                        pause = True
-                        break
-                    elif cmd == "stop":
-                        recording = False
-                        result_queue.put({"event": "record_idle", "worker": worker_name, "payload": {}})
-                        break
-                    elif cmd == "mic_mute":
-                        mic_mute = True
-                    elif cmd == "mic_unmute":
-                        mic_mute = False
-                    elif cmd == "vc_mute":
-                        vc_mute = True
-                    elif cmd == "vc_unmute":
-                        vc_mute = False
-                    
-                except queue.Empty:
-                    pass
-            
-            with wave.open(str(file_path), "wb") as wf:
+            result_queue.put({"event": Event.RECORD_STARTED, "worker": worker_name, "payload": {"session_id": str(session_id)}})
+            # WAVはセッション開始時に開き、チャンクごとに書き足す (メモリ使用量はセッションの長さによらず1チャンク分)
+            # ファイルは1MBのバッファ付きで開き、OSへの書き込みをまとめる。wave側のclose()でRIFFヘッダのサイズが書き直される
+            frames_written = 0
+            mic_ring.discard()
+            vc_ring.discard()
+            with open(file_path, "wb", buffering=1 << 20) as f, wave.open(f, "wb") as wf:
                 wf.setnchannels(output_channels)
-                wf.setsampwidth(pa.get_sample_size(FORMAT))
+                wf.setsampwidth(bytes_per_sample)
                 wf.setframerate(RATE)
-                wf.writeframes(b"".join(buffer))
+                write_frames = wf.writeframesraw
+                for i in range(chunks_per_session):
+                    # int32への変換は混合時にまとめて行うので、ここではint16のまま読む
+                    mic_read(mic_in, mic_stream)
+                    vc_read(vc_in, vc_stream)
+                    if mic_mute:
+                        mic_in.fill(0)
+                    if vc_mute:
+                        vc_in.fill(0)
+                    mix()
+                    # bytesへコピーせずにWAVへ渡す
+                    write_frames(chunk_out)
+                    frames_written += CHUNK
+
+                    if (i & cmd_poll_mask) == 0 and cmd_poll():
+                        cmd_raw = command_queue.recv()
+                        cmd = cmd_raw.get("task")
+                        print(f"[RecordWorker] Received command: {cmd}")
+                        if cmd == "pause":
+                            pause = True
+                            break
+                        elif cmd == "stop":
+                            recording = False
+                            result_queue.put({"event": Event.RECORD_IDLE, "worker": worker_name, "payload": {}})
+                            break
+                        elif cmd == "mic_mute":
+                            mic_mute = True
+                        elif cmd == "mic_unmute":
+                            mic_mute = False
+                        elif cmd == "vc_mute":
+                            vc_mute = True
+                        elif cmd == "vc_unmute":
+                            vc_mute = False
+
 
-            length = len(buffer) * CHUNK / RATE
+            length = frames_written / RATE
             result_queue.put({
-                "event": "record_done",
+                "event": Event.RECORD_DONE,
                 "worker": worker_name,
                 "payload": {
                     "session_id": str(session_id),
@@ -188,10 +287,10 @@ def record_worker(result_queue: multiprocessing.Queue,
                     "file_path": str(file_path)
                 }
             })
-            result_queue.put({"event": "record_idle", "worker": worker_name, "payload": {}})
+            result_queue.put({"event": Event.RECORD_IDLE, "worker": worker_name, "payload": {}})
     except Exception as e:
         result_queue.put({
-            "event": "error",
+            "event": Event.ERROR,
             "worker": worker_name,
             "payload": {"error_message": str(e)}
         })
@@ -1,43 +1,124 @@
-import multiprocessing
+from multiprocessing.connection import Connection
+from .command_channel import CommandChannel
+from .events import Event
 import time
+import json
+import numpy as np
+import ctranslate2
 from faster_whisper import WhisperModel
 
-def transcribe_worker(result_queue: multiprocessing.Queue,
-                      command_queue: multiprocessing.Queue,
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # faster-whisper 1.1以降。音声区間をまとめてデコードし、GPUの空き時間を減らす
+    from faster_whisper import BatchedInferencePipeline
+except ImportError:
+    BatchedInferencePipeline = None
+
+# 文字起こしのデコード設定。貪欲探索(beam_size=1)とVADで無音区間を飛ばし、長い録音でのデコード時間を抑える。
+# 前の文脈を条件にしないことで、無音が続いたあとの繰り返し出力も起きにくくなる。
+# 温度は0.0だけにして、信頼度の低い区間を温度を上げて最大5回デコードし直すフォールバックを行わない
+TRANSCRIBE_OPTIONS = {
+    "language": "ja",
+    "beam_size": 1,
+    "temperature": 0.0,
+    "vad_filter": True,
+    "condition_on_previous_text": False,
+}
+
+# GPUで一度にデコードする音声区間の数
+BATCH_SIZE = 8
+
+def resolve_device(device: str, compute_type: str):
+    """
+    (デバイス, GPU番号, 計算タイプ) を返す。"cuda:1" のように番号付きで指定されたGPUを使う。
+    CUDAが指定されていても使えるGPUが無い場合は、CPUとint8に切り替える。
+    """
+    device, _, index = device.partition(":")
+    device_index = int(index) if index else 0
+    if device == "cuda" and ctranslate2.get_cuda_device_count() == 0:
+        print("[WARNING] CUDA device not available. Falling back to CPU (int8).")
+        return "cpu", 0, "int8"
+    return device, device_index, compute_type
+
+def load_model(model_size: str, device: str, device_index: int, compute_type: str, cpu_threads: int = 0) -> WhisperModel:
+    """
+    モデルをロードする。一度ダウンロード済みならHugging Faceのキャッシュだけから読み、
+    再起動のたびに更新確認の通信を待たないようにする。キャッシュに無いときだけ通常どおりダウンロードする。
+    """
+    try:
+        return WhisperModel(model_size, device=device, device_index=device_index, compute_type=compute_type,
+                            cpu_threads=cpu_threads, local_files_only=True)
+    except Exception:
+        return WhisperModel(model_size, device=device, device_index=device_index, compute_type=compute_type,
+                            cpu_threads=cpu_threads)
+
+def warm_up(model: WhisperModel):
+    """1秒分の無音を一度文字起こしし、初回呼び出し時の初期化(CUDAカーネルの準備など)を起動時に済ませておく。"""
+    # VADを通すと無音はすべて除かれてモデルが動かないため、事前実行ではVADを切る
+    segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), **{**TRANSCRIBE_OPTIONS, "vad_filter": False})
+    list(segments)
+
+def dumps_segments(segments: list) -> str:
+    """セグメントをコンパクトなJSON文字列にする。orjsonがあればそちらを使う。"""
+    if orjson is not None:
+        return orjson.dumps(segments).decode('utf-8')
+    return json.dumps(segments, ensure_ascii=False, separators=(',', ':'))
+
+def transcribe_worker(result_queue: CommandChannel,
+                      command_queue: Connection,
                       model_size: str,
                       device: str,
                       compute_type: str,
-                      wait_seconds: int):
+                      cpu_threads: int = 0):
     """
     文字起こしタスクを処理するワーカープロセス。(faster-whisper版)
+    cpu_threads: CPUで推論するときのスレッド数。0ならfaster-whisperの既定 (4スレッド)
     """
     print(f"Transcribe worker started. Model: {model_size}, Device: {device}, ComputeType: {compute_type}")
     
     worker_name = "TranscribeWorker-1"
     try:
+        # "cuda:x" のような不正なデバイス指定やCUDAの確認失敗も、ロード失敗としてメインプロセスに報告する
+        device, device_index, compute_type = resolve_device(device, compute_type)
         # compute_type を指定して、最適化されたモデルをロードする
-        model = WhisperModel(model_size, device=device, compute_type=compute_type)
+        model = load_model(model_size, device, device_index, compute_type, cpu_threads)
         print("Faster-Whisper model loaded successfully.")
     except Exception as e:
         print(f"[FATAL] Failed to load Faster-Whisper model: {e}")
         result_queue.put({
-            "event": "error",
+            "event": Event.ERROR,
             "worker": worker_name,
             "payload": {"error_message": f"Faster-Whisperモデルのロードに失敗: {e}"}
         })
         return
 
+    try:
+        warm_up(model)
+    except Exception as e:
+        # 事前実行に失敗しても、本番の文字起こしで同じ初期化が行われるだけなので続行する
+        print(f"[WARNING] Failed to warm up Faster-Whisper model: {e}")
+
+    # GPUではVADで切り出した区間をまとめて1回のデコードに載せる。CPUでは区間ごとの逐次デコードの方が速いのでそのまま使う
+    transcriber, options = model, TRANSCRIBE_OPTIONS
+    if device.startswith("cuda") and BatchedInferencePipeline is not None:
+        transcriber = BatchedInferencePipeline(model=model)
+        options = {**TRANSCRIBE_OPTIONS, "batch_size": BATCH_SIZE}
+
     while True:
         try:
             # 1. メインプロセスに仕事があるか問い合わせる
             result_queue.put({
-                "event": "request_transcribe_job",
+                "event": Event.REQUEST_TRANSCRIBE_JOB,
                 "worker": worker_name,
                 "payload": {}
             })
 
             # 2. メインプロセスからの指令を待つ
-            command = command_queue.get()
+            command = command_queue.recv()
             task = command.get("task")
             payload = command.get("payload", {})
 
@@ -46,52 +127,49 @@ def transcribe_worker(result_queue: multiprocessing.Queue,
                 session_id = payload['session_id']
                 file_path = payload['file_path']
                 print(f"Received job: Transcribing {file_path}")
-                result_queue.put({"event": "transcribe_started", "worker": worker_name, "payload": {"session_id": session_id}})
+                result_queue.put({"event": Event.TRANSCRIBE_STARTED, "worker": worker_name, "payload": {"session_id": session_id}})
 
                 # ▼▼▼ 文字起こし部分を faster-whisper に変更 ▼▼▼
-                segments_generator, info = model.transcribe(file_path, language="ja")
+                segments_generator, info = transcriber.transcribe(file_path, **options)
                 print(f"Detected language '{info.language}' with probability {info.language_probability}")
 
-                clean_segments = []
                 # ジェネレータからセグメントを一つずつ取り出して処理する
-                for segment in segments_generator:
-                    clean_segments.append({
-                        "start": segment.start,
-                        "end": segment.end,
-                        "text": segment.text.strip()
-                    })
+                clean_segments = [
+                    {"start": segment.start, "end": segment.end, "text": segment.text.strip()}
+                    for segment in segments_generator
+                ]
                 
                 print(f"Transcription finished for {session_id}.")
                 
                 # 4. 完了報告をメインプロセスに送る
+                # セグメントはJSON文字列1つにまとめて送る (細かいdictを大量にpickleせずに済み、DBにもそのまま保存できる)
                 result_queue.put({
-                    "event": "transcribe_done",
+                    "event": Event.TRANSCRIBE_DONE,
                     "worker": worker_name,
                     "payload": {
                         "session_id": session_id,
-                        "segments_json": clean_segments
+                        "segments_json": dumps_segments(clean_segments)
                     }
                 })
-                result_queue.put({"event": "transcribe_idle", "worker": worker_name, "payload": {}})
+                result_queue.put({"event": Event.TRANSCRIBE_IDLE, "worker": worker_name, "payload": {}})
 
-            elif task == "standby":
-                print(f"No job found. Standing by for {wait_seconds} seconds...")
-                result_queue.put({"event": "transcribe_idle", "worker": worker_name, "payload": {}})
-                time.sleep(wait_seconds)
-            
             elif task == "stop":
                 print("Stop command received. Exiting worker.")
-                result_queue.put({"event": "transcribe_idle", "worker": worker_name, "payload": {}})
+                result_queue.put({"event": Event.TRANSCRIBE_IDLE, "worker": worker_name, "payload": {}})
                 break
 
             else:
                 print(f"[WARNING] Unknown command received: {task}")
-                result_queue.put({"event": "transcribe_idle", "worker": worker_name, "payload": {}})
+                result_queue.put({"event": Event.TRANSCRIBE_IDLE, "worker": worker_name, "payload": {}})
 
+        except EOFError:
+            # メインプロセス側の送信チャネルが閉じられた
+            print("Command channel closed. Exiting worker.")
+            break
         except Exception as e:
             print(f"[ERROR] An unexpected error occurred in transcribe_worker: {e}")
             result_queue.put({
-                "event": "error",
+                "event": Event.ERROR,
                 "worker": worker_name,
                 "payload": {"error_message": str(e)}
             })